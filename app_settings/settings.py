@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 from pathlib import Path
 import os
 import sys
+import tempfile
 from corsheaders.defaults import default_headers
 from django.conf import settings
 from django.core.cache.backends.base import DEFAULT_TIMEOUT
@@ -91,22 +92,120 @@ REST_FRAMEWORK = {
     ],
 }
 
+# the video list is cursor paginated, clients can ask for up to VIDEO_MAX_PAGE_SIZE videos with ?page_size=
+VIDEO_PAGE_SIZE = 24
+VIDEO_MAX_PAGE_SIZE = 100
+
+# videos per row of /api/feed/, the rows are kept in the cache and rebuilt when one of their videos changes
+FEED_ROW_SIZE = 12
+
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# how stream_video sends media => 'sendfile' from Django, only gunicorn sends it with os.sendfile through
+# wsgi.file_wrapper, runserver and other servers read it in blocks,
+# 'x-accel-redirect' through the internal nginx location MEDIA_ACCEL_REDIRECT_PREFIX or 'x-sendfile' for Apache/lighttpd
+MEDIA_STREAM_MODE = os.getenv('MEDIA_STREAM_MODE', 'sendfile')
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
+# the API hands out media URLs signed with SECRET_KEY, they expire after MEDIA_URL_TTL seconds
+# rounded up to MEDIA_URL_BUCKET, so a URL stays the same within the bucket and can be cached
+MEDIA_URL_TTL = 60 * 60 * 6
+MEDIA_URL_BUCKET = 60 * 60
+
+# resumable uploads are assembled here before they are moved to videos/
+UPLOAD_CHUNK_DIR = os.path.join(MEDIA_ROOT, 'uploads')
+
+# same as Django's default handlers, but uploads are hashed while they stream in to find duplicates
+FILE_UPLOAD_HANDLERS = [
+    'streamada.uploadhandlers.HashingMemoryFileUploadHandler',
+    'streamada.uploadhandlers.HashingTemporaryFileUploadHandler',
+]
+
 ROOT_URLCONF = 'app_settings.urls'
 
 DEBUG=True
 
+# a worker takes its jobs from the queues in the order they are listed, so the order is the priority =>
+# rqworker cache email preview transcode backfill default
 RQ_QUEUES = {
     'default': {
         'HOST': 'localhost',
         'PORT': 6379,
         'DB': 0,
         'DEFAULT_TIMEOUT': 360,
-    }
+    },
+    # refreshes of cached API responses that are served stale meanwhile, they take milliseconds
+    'cache': {
+        'HOST': 'localhost',
+        'PORT': 6379,
+        'DB': 0,
+        'DEFAULT_TIMEOUT': 60,
+    },
+    # activation and password reset emails, never stuck behind a transcode
+    'email': {
+        'HOST': 'localhost',
+        'PORT': 6379,
+        'DB': 0,
+        'DEFAULT_TIMEOUT': 60,
+    },
+    # fast low quality encodes that make new uploads playable
+    'preview': {
+        'HOST': 'localhost',
+        'PORT': 6379,
+        'DB': 0,
+        'DEFAULT_TIMEOUT': 60 * 10,
+    },
+    # analysis, renditions, HLS packaging and finalize of new uploads
+    'transcode': {
+        'HOST': 'localhost',
+        'PORT': 6379,
+        'DB': 0,
+        'DEFAULT_TIMEOUT': 60 * 60 * 4,
+    },
+    # renditions re-enqueued by reconcile_transcodes and other work on existing videos
+    'backfill': {
+        'HOST': 'localhost',
+        'PORT': 6379,
+        'DB': 0,
+        'DEFAULT_TIMEOUT': 60 * 60 * 4,
+    },
 }
 
+# 'single_pass' decodes the upload once and writes every rendition from one ffmpeg call, one upload is one job
+# on one worker. 'per_rendition' runs one convert_video job for every rendition, so several workers convert the
+# renditions of one upload in parallel, each decoding the upload again.
+VIDEO_TRANSCODE_MODE = os.getenv('VIDEO_TRANSCODE_MODE', 'single_pass')
+
+# videos of at least this many seconds are split into VIDEO_CHUNK_WORKERS segments that are encoded in parallel
+VIDEO_CHUNKED_MIN_DURATION = int(os.getenv('VIDEO_CHUNKED_MIN_DURATION', 600))
+VIDEO_CHUNK_WORKERS = int(os.getenv('VIDEO_CHUNK_WORKERS', os.cpu_count() or 1))
+
+# all workers of a host share FFMPEG_MAX_PROCESSES ffmpeg slots and every encode gets FFMPEG_THREADS threads,
+# so several jobs landing at the same time do not oversubscribe the cores
+FFMPEG_MAX_PROCESSES = int(os.getenv('FFMPEG_MAX_PROCESSES', max(1, (os.cpu_count() or 1) // 4)))
+FFMPEG_THREADS = int(os.getenv('FFMPEG_THREADS', max(1, (os.cpu_count() or 1) // FFMPEG_MAX_PROCESSES)))
+FFMPEG_SLOT_DIR = os.getenv('FFMPEG_SLOT_DIR', os.path.join(tempfile.gettempdir(), 'streamada-ffmpeg-slots'))
+
+# height of the ultrafast preview encode that is playable before the quality renditions are done
+PREVIEW_HEIGHT = 360
+
+# scrub preview thumbnails, one every TRICKPLAY_INTERVAL seconds tiled into sprite sheets of TRICKPLAY_GRID
+TRICKPLAY_INTERVAL = 10
+TRICKPLAY_THUMBNAIL_SIZE = (160, 90)
+TRICKPLAY_GRID = (5, 5)
+
+# reconcile_transcodes re-enqueues the work of a video after this many seconds without a live job
+TRANSCODE_STALE_AFTER = 10 * 60
+# after this many re-enqueues a video is only reported, its jobs keep failing and need a look
+TRANSCODE_MAX_ATTEMPTS = 3
+
+# tombstones of deleted videos that one purge_media_tombstones job removes from the disk
+MEDIA_PURGE_BATCH = 100
+
+# length of one HLS segment in seconds, the renditions get a keyframe at every segment boundary
+HLS_SEGMENT_SECONDS = 6
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -137,6 +236,16 @@ CACHES = {
 
 CACHE_TTL = getattr(settings, 'CACHE_TTL', DEFAULT_TIMEOUT)
 
+# cached API responses are fresh for API_CACHE_FRESH seconds, afterwards they are served for up to
+# API_CACHE_STALE seconds more while a job on the cache queue builds them again
+API_CACHE_FRESH = 60 * 5
+API_CACHE_STALE = 60 * 5
+# a missing response is built by one request, the others wait up to API_CACHE_LOCK_WAIT seconds for it
+API_CACHE_LOCK_TIMEOUT = 30
+API_CACHE_LOCK_WAIT = 5
+# fresh responses are refreshed early with a chance that grows towards their expiry, a higher beta refreshes earlier
+API_CACHE_BETA = 1.0
+
 WSGI_APPLICATION = 'app_settings.wsgi.application'
 
 
@@ -19,9 +19,8 @@ from django.urls import include, path
 from django.shortcuts import redirect
 from streamada import views
 from streamada.views import PasswordResetConfirmView, PasswordResetView, VideoListAPIView, activate_user, register_user
-from django.conf import settings
-from django.conf.urls.static import static
-from streamada.views import VideoDetailAPIView
+from streamada.views import VideoDetailAPIView, video_status, VideoUploadCreateView, VideoUploadView, stream_video
+from streamada.views import serve_signed_media, video_feed, video_search
 
 
 urlpatterns = [
@@ -32,10 +31,17 @@ urlpatterns = [
     path('api/login/', views.login_user, name='login'),
     path('api/password-reset/', PasswordResetView.as_view(), name='password_reset'),
     path('api/confirm-new-pw/', PasswordResetConfirmView.as_view(), name='confirm-new-pw'),
+    path('api/feed/', video_feed, name='video-feed'),
     path('api/videos/', VideoListAPIView.as_view(), name='video-list'),
+    path('api/videos/search/', video_search, name='video-search'),
     path('api/videos/<int:id>/', VideoDetailAPIView.as_view(), name='video-detail'),
+    path('api/videos/<int:id>/status/', video_status, name='video-status'),
+    path('api/videos/<int:id>/stream/<str:label>/', stream_video, name='video-stream'),
+    path('api/uploads/', VideoUploadCreateView.as_view(), name='video-upload-create'),
+    path('api/uploads/<uuid:upload_id>/', VideoUploadView.as_view(), name='video-upload'),
+    path('api/media/<str:token>/<path:name>', serve_signed_media, name='signed-media'),
     path('django-rq/', include('django_rq.urls')),
-]+ static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+]
 
 
 
@@ -1,14 +1,37 @@
 from django.contrib import admin
 from django.http import HttpResponseRedirect
-from .models import Video
+from .models import Video, VideoRendition
 from django.utils.html import format_html
 from django.urls import path
 from django.utils.translation import gettext_lazy as _
+from streamada.progress import get_progress
+
+
+class VideoRenditionInline(admin.TabularInline):
+    model = VideoRendition
+    extra = 0
+    readonly_fields = ('label', 'status', 'path', 'size', 'checksum', 'job_id', 'error', 'updated_at')
+    can_delete = False
+
 
 
 class VideoAdmin(admin.ModelAdmin):
-    list_display = ('title', 'id', 'genre', 'rq_dashboard_link')
-    readonly_fields = ('id',)
+    list_display = ('title', 'id', 'genre', 'is_ready', 'transcode_progress', 'rq_dashboard_link')
+    readonly_fields = ('id', 'is_ready', 'preview_ready', 'trickplay_sheets', 'duration', 'width', 'height',
+                       'frame_rate', 'bitrate', 'video_codec', 'audio_codec')
+    inlines = [VideoRenditionInline]
+
+    def transcode_progress(self, obj):
+        if obj.is_ready:
+            return 'ready'
+        labels = [label for _, label in obj.rendition_ladder]
+        progress = get_progress(obj.id, labels)
+        return ', '.join(
+            f"{label}: {data['percent']}% ({data['speed']}x)" if data.get('percent') is not None else f"{label}: {data['state']}"
+            for label, data in progress.items()
+        )
+
+    transcode_progress.short_description = 'Transcode progress'
 
     def rq_dashboard_link(self, obj):
         return format_html('<a href="{}" target="_blank">RQ Dashboard</a>', '/django-rq/')
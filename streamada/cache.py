@@ -0,0 +1,139 @@
+import hashlib
+import io
+import math
+import random
+import time
+from urllib.parse import urlsplit
+import django_rq
+from django.conf import settings
+from django.core.cache import cache
+from django.core.handlers.wsgi import WSGIRequest
+from django.http import Http404
+from django.utils.module_loading import import_string
+from rest_framework.request import Request
+
+
+VIDEO_CACHE_VERSION_KEY = 'video-cache-version'
+API_CACHE_POLL = 0.05
+
+
+
+def video_cache_version():
+    """
+    Version of every cached video API response. A missing version (first start, eviction) starts at the current
+    time in nanoseconds, so it never goes back to a version whose responses may still be cached.
+    """
+    version = cache.get(VIDEO_CACHE_VERSION_KEY)
+    if version is None:
+        cache.add(VIDEO_CACHE_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VIDEO_CACHE_VERSION_KEY)
+    return version
+
+
+
+def bump_video_cache_version():
+    """Invalidates all cached video API responses at once, the old keys simply expire"""
+    try:
+        return cache.incr(VIDEO_CACHE_VERSION_KEY)
+    except ValueError:
+        cache.add(VIDEO_CACHE_VERSION_KEY, time.time_ns(), None)
+        return cache.get(VIDEO_CACHE_VERSION_KEY)
+
+
+
+def builder_path(build):
+    return f'{build.__module__}.{build.__qualname__}'
+
+
+
+def api_cache_key(url, path):
+    # host and scheme are part of the key, because DRF builds absolute URLs (video_file, next/previous links)
+    return f'api:{video_cache_version()}:{path}:{hashlib.sha256(url.encode()).hexdigest()}'
+
+
+
+def store_api_data(key, data, build_seconds):
+    """Stores data with its expiry and the time it took to build, which scales the early refresh"""
+    entry = {'data': data, 'delta': build_seconds, 'expires': time.time() + settings.API_CACHE_FRESH}
+    cache.set(key, entry, settings.API_CACHE_FRESH + settings.API_CACHE_STALE)
+    return data
+
+
+
+def build_api_data(build, request, kwargs):
+    start = time.perf_counter()
+    data = build(request, **kwargs)
+    return data, time.perf_counter() - start
+
+
+
+def refresh_due(entry):
+    """
+    XFetch: True once the entry is expired and, before that, with a chance that grows towards the expiry
+    and with the build time, so hot keys are usually refreshed before any request sees them expire.
+    """
+    early = entry['delta'] * settings.API_CACHE_BETA * -math.log(1.0 - random.random())
+    return time.time() + early >= entry['expires']
+
+
+
+def cached_api_data(request, build, **kwargs):
+    """
+    Returns build(request, **kwargs) from the cache. build is a module level function, so refresh_api_cache
+    can run it again from the URL alone. The data must not hold signed media URLs, the views sign them per response.
+    - fresh => served from the cache
+    - due for a refresh or stale => still served, one request enqueues refresh_api_cache on the cache queue
+    - missing => built by the request that gets the lock, the others wait for its result (single flight)
+    """
+    url = request.build_absolute_uri()
+    path = builder_path(build)
+    key = api_cache_key(url, path)
+    lock_key = f'{key}:lock'
+
+    entry = cache.get(key)
+    if entry is not None:
+        if refresh_due(entry) and cache.add(lock_key, True, settings.API_CACHE_LOCK_TIMEOUT):
+            django_rq.get_queue('cache').enqueue(refresh_api_cache, path, key, url, kwargs)
+        return entry['data']
+
+    if cache.add(lock_key, True, settings.API_CACHE_LOCK_TIMEOUT):
+        try:
+            return store_api_data(key, *build_api_data(build, request, kwargs))
+        finally:
+            cache.delete(lock_key)
+
+    deadline = time.monotonic() + settings.API_CACHE_LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(API_CACHE_POLL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry['data']
+    # the lock holder is slow or died, build without it
+    return build(request, **kwargs)
+
+
+
+def replay_request(url):
+    """A GET request for an absolute URL, for the builders that run outside of a request"""
+    parts = urlsplit(url)
+    return Request(WSGIRequest({
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': parts.path,
+        'QUERY_STRING': parts.query,
+        'HTTP_HOST': parts.netloc,
+        'SERVER_NAME': parts.hostname,
+        'SERVER_PORT': str(parts.port or (443 if parts.scheme == 'https' else 80)),
+        'wsgi.url_scheme': parts.scheme,
+        'wsgi.input': io.BytesIO(),
+    }))
+
+
+
+def refresh_api_cache(path, key, url, kwargs):
+    """RQ job that builds a cached API response again while the old one is still served"""
+    try:
+        store_api_data(key, *build_api_data(import_string(path), replay_request(url), kwargs))
+    except Http404:
+        cache.delete(key)
+    finally:
+        cache.delete(f'{key}:lock')
@@ -0,0 +1,67 @@
+from django.conf import settings
+from django.core.cache import cache
+from streamada.models import Video, GENRE_CHOICES
+from streamada.fragments import FRAGMENT_COLUMNS, fragment_rows
+
+
+NEW_VIDEO_FEED = 'new_video_feed'
+
+
+
+def feed_rows():
+    """The new video feed and one row per genre, in the order of the home screen"""
+    return [NEW_VIDEO_FEED] + [genre for genre, _ in GENRE_CHOICES]
+
+
+
+def feed_row_key(row):
+    return f'video-feed:{row}'
+
+
+
+def build_feed_row(row):
+    """
+    (id, fragment, media) of the newest FEED_ROW_SIZE videos of a row, with unsigned media URLs.
+    One query on the composite index of the row.
+    """
+    videos = Video.objects.order_by('-uploaded_at', '-id')
+    if row == NEW_VIDEO_FEED:
+        videos = videos.filter(add_to_new_video_feed=True)
+    else:
+        videos = videos.filter(genre=row)
+    return fragment_rows(videos.values(*FRAGMENT_COLUMNS)[:settings.FEED_ROW_SIZE])
+
+
+
+def get_feed():
+    """
+    Returns row => (id, fragment, media) of its videos from a single cache round trip. The rows are kept up to date by
+    refresh_feed, only a row that is missing from the cache (cold start, eviction) is built here.
+    """
+    keys = {row: feed_row_key(row) for row in feed_rows()}
+    cached = cache.get_many(list(keys.values()))
+    missing = {key: build_feed_row(row) for row, key in keys.items() if key not in cached}
+    if missing:
+        cache.set_many(missing, None)
+        cached.update(missing)
+    return {row: cached[key] for row, key in keys.items()}
+
+
+
+def refresh_feed(video_id):
+    """
+    Rebuilds the rows that show the video now or showed it before it changed, so a new genre
+    or a removed feed flag takes it out of its old row. The other rows stay as they are.
+    """
+    keys = {row: feed_row_key(row) for row in feed_rows()}
+    cached = cache.get_many(list(keys.values()))
+    rows = {row for row, key in keys.items() if any(row_id == video_id for row_id, _, _ in cached.get(key, []))}
+    video = Video.objects.filter(pk=video_id).values('genre', 'add_to_new_video_feed').first()
+    if video:
+        rows.add(video['genre'])
+        if video['add_to_new_video_feed']:
+            rows.add(NEW_VIDEO_FEED)
+    rows &= set(keys)
+    if rows:
+        cache.set_many({keys[row]: build_feed_row(row) for row in rows}, None)
+    return sorted(rows)
@@ -0,0 +1,68 @@
+import json
+from rest_framework.utils.encoders import JSONEncoder
+from streamada.models import Video
+from streamada.serializers import VideoSerializer, SIGNED_MEDIA_FIELDS, sign_media_fields
+
+
+# fields of VideoSerializer that depend on the request => the signed media URLs and the absolute video_file URL
+FRAGMENT_MEDIA_FIELDS = [*SIGNED_MEDIA_FIELDS, 'video_file']
+
+# the columns fragment_rows needs, uploaded_at for the cursor of the video list
+FRAGMENT_COLUMNS = ('id', 'uploaded_at', 'api_fragment', 'media_urls')
+
+
+
+def dumps(data):
+    # the same output as DRF's JSONRenderer
+    return json.dumps(data, cls=JSONEncoder, ensure_ascii=False, allow_nan=False, separators=(',', ':'))
+
+
+
+def build_video_fragment(video):
+    """
+    Returns (fragment, media) of a video => the JSON object of VideoSerializer without the request dependent
+    fields and a dict of those fields with unsigned, relative URLs.
+    """
+    data = dict(VideoSerializer(video, context={'sign_media': False}).data)
+    media = {field: data.pop(field) for field in FRAGMENT_MEDIA_FIELDS}
+    return dumps(data), media
+
+
+
+def store_video_fragment(video_id):
+    """Serializes the video once and stores the result on it, returns (fragment, media) or None if it is gone"""
+    video = Video.objects.prefetch_related('renditions').filter(pk=video_id).first()
+    if video is None:
+        return None
+    fragment, media = build_video_fragment(video)
+    Video.objects.filter(pk=video_id).update(api_fragment=fragment, media_urls=media)
+    return fragment, media
+
+
+
+def fragment_rows(rows):
+    """
+    (id, fragment, media) of Video rows from values(*FRAGMENT_COLUMNS). Videos that were saved before
+    the fragments existed get theirs now.
+    """
+    result = []
+    for row in rows:
+        if row['api_fragment']:
+            result.append((row['id'], row['api_fragment'], row['media_urls']))
+        else:
+            result.append((row['id'], *store_video_fragment(row['id'])))
+    return result
+
+
+
+def render_video(fragment, media, request=None):
+    """Splices the signed media URLs of the request into the stored fragment, no serializer runs"""
+    media = sign_media_fields(dict(media), request)
+    if media['video_file'] and request:
+        media['video_file'] = request.build_absolute_uri(media['video_file'])
+    return fragment[:-1] + ',' + dumps(media)[1:] if fragment != '{}' else dumps(media)
+
+
+
+def render_videos(rows, request=None):
+    return '[' + ','.join(render_video(fragment, media, request) for _, fragment, media in rows) + ']'
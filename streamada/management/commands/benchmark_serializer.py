@@ -0,0 +1,85 @@
+import json
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from streamada.cache import replay_request
+from streamada.fragments import FRAGMENT_COLUMNS, build_video_fragment, fragment_rows, render_videos
+from streamada.models import Video, VideoRendition, VIDEO_RENDITIONS
+from streamada.serializers import VideoSerializer
+
+
+
+def create_videos(count):
+    """Ready videos with every rendition, a thumbnail and trickplay sprites, created without the signals"""
+    videos = Video.objects.bulk_create([
+        Video(title=f'Benchmark {index}', description='Benchmark video', genre='Explore',
+              video_file=f'videos/benchmark_{index}.mp4', thumbnail=f'thumbnails/benchmark_{index}.jpg',
+              is_ready=True, preview_ready=True, height=1080, trickplay_sheets=3)
+        for index in range(count)
+    ])
+    VideoRendition.objects.bulk_create([
+        VideoRendition(video=video, label=label, status=VideoRendition.DONE,
+                       path=f'videos/benchmark_{video.id}_{label}.0123456789abcdef.mp4')
+        for video in videos for _, label in VIDEO_RENDITIONS
+    ])
+    return [video.id for video in videos]
+
+
+
+def serializer_path(ids, request):
+    """The response as VideoSerializer and DRF's JSONRenderer build it"""
+    videos = list(Video.objects.filter(pk__in=ids).prefetch_related('renditions'))
+    start = time.perf_counter()
+    JSONRenderer().render(VideoSerializer(videos, many=True, context={'request': request}).data)
+    return time.perf_counter() - start
+
+
+
+def fragment_path(ids, request):
+    """The response spliced from the stored fragments"""
+    rows = fragment_rows(Video.objects.filter(pk__in=ids).values(*FRAGMENT_COLUMNS))
+    start = time.perf_counter()
+    render_videos(rows, request)
+    return time.perf_counter() - start
+
+
+
+BENCHMARK_PATHS = {
+    'serializer': serializer_path,
+    'fragments': fragment_path,
+}
+
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the rows per second of VideoSerializer against the stored JSON fragments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='Videos per response')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per path, the fastest one is reported')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+
+    def handle(self, *args, **options):
+        request = replay_request('http://localhost/api/videos/')
+        results = {}
+        # the videos only exist inside the transaction, it is rolled back at the end
+        with transaction.atomic():
+            ids = create_videos(options['rows'])
+            videos = Video.objects.filter(pk__in=ids).prefetch_related('renditions')
+            for video in videos:
+                video.api_fragment, video.media_urls = build_video_fragment(video)
+            Video.objects.bulk_update(videos, ['api_fragment', 'media_urls'])
+
+            for name, run in BENCHMARK_PATHS.items():
+                seconds = min(run(ids, request) for _ in range(options['repeat']))
+                results[name] = {'seconds': round(seconds, 4), 'rows_per_second': round(len(ids) / seconds)}
+            transaction.set_rollback(True)
+
+        for name, result in results.items():
+            self.stdout.write(f"{name:<12} {result['rows_per_second']:>10} rows/s  {result['seconds']:.4f} s")
+        self.stdout.write(f"Speedup: {results['serializer']['seconds'] / results['fragments']['seconds']:.1f}x")
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump({'rows': options['rows'], 'results': results}, file, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
@@ -0,0 +1,152 @@
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from streamada.models import select_renditions
+from streamada.tasks import convert_video, convert_video_single_pass, convert_video_chunked, encode_audio
+
+
+FRAME_RATE = 30
+
+
+
+def run_per_rendition(source, renditions, duration_seconds):
+    # the jobs run one after another here, so the CPU seconds compare with the other modes
+    audio = encode_audio(source)
+    return {label: convert_video(source, resolution, label, trickplay=(index == 0), audio=audio)
+            for index, (resolution, label) in enumerate(renditions)}
+
+
+def run_single_pass(source, renditions, duration_seconds):
+    return convert_video_single_pass(source, renditions)
+
+
+def run_chunked(source, renditions, duration_seconds):
+    return convert_video_chunked(source, renditions, duration_seconds)
+
+
+BENCHMARK_MODES = {
+    'per_rendition': run_per_rendition,
+    'single_pass': run_single_pass,
+    'chunked': run_chunked,
+}
+
+
+
+def generate_source(folder, width, height, duration_seconds):
+    """
+    Writes a synthetic source with ffmpeg's lavfi test pattern and a sine tone, so no sample files are needed.
+    """
+    source = os.path.join(folder, f'source_{width}x{height}_{duration_seconds}s.mp4')
+    cmd = ['ffmpeg', '-y', '-v', 'error',
+           '-f', 'lavfi', '-i', f'testsrc2=size={width}x{height}:rate={FRAME_RATE}:duration={duration_seconds}',
+           '-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate=48000:duration={duration_seconds}',
+           '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '18', '-pix_fmt', 'yuv420p',
+           '-c:a', 'aac', '-shortest', source]
+    subprocess.run(cmd, check=True)
+    return source
+
+
+
+def measure(mode, source, renditions, duration_seconds):
+    """
+    Runs one mode on a private copy of the source and returns wall time, CPU seconds and peak RSS of the
+    ffmpeg processes and the bytes of every rendition. Runs in its own process, so the child rusage
+    only covers this run.
+    """
+    folder = tempfile.mkdtemp(prefix=f'{mode}_', dir=os.path.dirname(source))
+    try:
+        copy = shutil.copy(source, os.path.join(folder, 'video.mp4'))
+        before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        start = time.perf_counter()
+        targets = BENCHMARK_MODES[mode](copy, renditions, duration_seconds)
+        wall_seconds = time.perf_counter() - start
+        after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return {
+            'wall_seconds': round(wall_seconds, 3),
+            'cpu_seconds': round(after.ru_utime + after.ru_stime - before.ru_utime - before.ru_stime, 3),
+            'peak_rss_mb': round(after.ru_maxrss / 1024, 1),
+            'fps': round(duration_seconds * FRAME_RATE / wall_seconds, 1),
+            'renditions': {label: os.path.getsize(target) for label, target in targets.items()},
+        }
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+
+def ffmpeg_version():
+    try:
+        output = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.splitlines()[0]
+
+
+
+def format_table(results):
+    header = ['source', 'mode', 'rendition', 'wall s', 'fps', 'cpu s', 'peak rss mb', 'bytes']
+    rows = [header]
+    for result in results:
+        source = f"{result['width']}x{result['height']} {result['duration_seconds']}s"
+        for label, size in result['renditions'].items():
+            rows.append([source, result['mode'], label, result['wall_seconds'], result['fps'],
+                         result['cpu_seconds'], result['peak_rss_mb'], size])
+    widths = [max(len(str(row[column])) for row in rows) for column in range(len(header))]
+    return '\n'.join('  '.join(str(value).ljust(width) for value, width in zip(row, widths)) for row in rows)
+
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the transcode modes on synthetic lavfi sources, prints a table and writes JSON for diffing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='640x360,1280x720,1920x1080',
+                            help='Comma separated source sizes like 1280x720')
+        parser.add_argument('--durations', default='10,60', help='Comma separated source durations in seconds')
+        parser.add_argument('--modes', default=','.join(BENCHMARK_MODES), help='Comma separated transcode modes')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+
+    def handle(self, *args, **options):
+        modes = options['modes'].split(',')
+        unknown = set(modes) - set(BENCHMARK_MODES)
+        if unknown:
+            raise CommandError(f"Unknown modes: {', '.join(sorted(unknown))}")
+        try:
+            sizes = [tuple(int(value) for value in size.split('x')) for size in options['sizes'].split(',')]
+            durations = [int(duration) for duration in options['durations'].split(',')]
+        except ValueError:
+            raise CommandError('Sizes look like 1280x720 and durations are whole seconds')
+
+        results = []
+        with tempfile.TemporaryDirectory(prefix='streamada-benchmark-') as folder:
+            for width, height in sizes:
+                for duration_seconds in durations:
+                    source = generate_source(folder, width, height, duration_seconds)
+                    renditions = select_renditions(height)
+                    for mode in modes:
+                        self.stderr.write(f'{width}x{height} {duration_seconds}s {mode}...')
+                        # a fresh process per run, ru_maxrss of the children is a high water mark
+                        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('fork')) as pool:
+                            result = pool.submit(measure, mode, source, renditions, duration_seconds).result()
+                        results.append({'width': width, 'height': height, 'duration_seconds': duration_seconds,
+                                        'mode': mode, **result})
+
+        report = {
+            'ffmpeg': ffmpeg_version(),
+            'cpu_count': os.cpu_count(),
+            'ffmpeg_max_processes': settings.FFMPEG_MAX_PROCESSES,
+            'ffmpeg_threads': settings.FFMPEG_THREADS,
+            'results': results,
+        }
+        self.stdout.write(format_table(results))
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
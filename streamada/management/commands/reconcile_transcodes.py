@@ -0,0 +1,31 @@
+import time
+from django.core.management.base import BaseCommand
+from streamada.models import Video
+from streamada.tasks import ReconcileAttemptsExhausted, reconcile_video
+
+
+
+class Command(BaseCommand):
+    help = 'Re-enqueues the missing or failed renditions of videos whose transcode jobs were interrupted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Keep running and scan again every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            self.reconcile()
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def reconcile(self):
+        # ready videos are complete and their upload is deleted, so only the others can be recovered
+        for video in Video.objects.filter(is_ready=False).prefetch_related('renditions'):
+            try:
+                enqueued = reconcile_video(video)
+            except ReconcileAttemptsExhausted as error:
+                self.stderr.write(f'{error}, check the failed jobs of the video instead of enqueueing it again')
+                continue
+            if enqueued:
+                self.stdout.write(f"Video {video.id}: enqueued {', '.join(enqueued)}")
@@ -0,0 +1,32 @@
+import time
+from django.core.management.base import BaseCommand
+from streamada.storage import find_orphaned_media, remove_media_path
+
+
+
+class Command(BaseCommand):
+    help = 'Reports files in MEDIA_ROOT/videos and MEDIA_ROOT/thumbnails that no video references'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete', action='store_true', help='Remove the orphaned files')
+        parser.add_argument('--min-age', type=int, default=60 * 60,
+                            help='Skip files changed within the last MIN_AGE seconds')
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Keep running and sweep again every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            self.sweep(options['delete'], options['min_age'])
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def sweep(self, delete, min_age):
+        orphans = find_orphaned_media(min_age)
+        for path, size in orphans:
+            self.stdout.write(f'{size:>14}  {path}')
+            if delete:
+                remove_media_path(path)
+        total = sum(size for _, size in orphans)
+        action = 'Reclaimed' if delete else 'Reclaimable'
+        self.stdout.write(f'{action}: {total} bytes ({total / 1024 / 1024:.1f} MB) in {len(orphans)} orphaned entries')
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.1 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+def mark_existing_videos_ready(apps, schema_editor):
+    # videos uploaded before the fan-in step existed were already converted
+    Video = apps.get_model('streamada', 'Video')
+    Video.objects.update(is_ready=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streamada', '0009_alter_video_description'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='is_ready',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(mark_existing_videos_ready, migrations.RunPython.noop),
+    ]
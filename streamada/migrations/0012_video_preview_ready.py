@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streamada', '0011_video_probe_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='preview_ready',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streamada', '0012_video_preview_ready'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='trickplay_sheets',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streamada', '0015_videoupload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VideoRendition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('label', models.CharField(max_length=16)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=16)),
+                ('job_id', models.CharField(blank=True, max_length=64)),
+                ('size', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('checksum', models.CharField(blank=True, max_length=64)),
+                ('error', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='renditions', to='streamada.video')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('video', 'label'), name='unique_video_rendition')],
+            },
+        ),
+    ]
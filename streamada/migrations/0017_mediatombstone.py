@@ -0,0 +1,22 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streamada', '0016_videorendition'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('video_file', models.CharField(blank=True, max_length=255)),
+                ('thumbnail', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:30
+
+import streamada.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streamada', '0017_mediatombstone'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videorendition',
+            name='path',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='video',
+            name='thumbnail',
+            field=models.ImageField(blank=True, null=True, upload_to=streamada.models.thumbnail_upload_to),
+        ),
+    ]
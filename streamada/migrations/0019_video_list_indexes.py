@@ -0,0 +1,25 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streamada', '0018_videorendition_path'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['-uploaded_at', '-id'], name='video_uploaded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['genre', '-uploaded_at', '-id'], name='video_genre_uploaded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['add_to_new_video_feed', '-uploaded_at', '-id'], name='video_feed_uploaded_idx'),
+        ),
+    ]
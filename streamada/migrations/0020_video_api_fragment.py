@@ -0,0 +1,23 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streamada', '0019_video_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='api_fragment',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='media_urls',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
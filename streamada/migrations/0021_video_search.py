@@ -0,0 +1,44 @@
+from django.db import migrations
+
+
+# the table is written by streamada.search from the Video signals, Django does not manage it
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE streamada_video_search USING fts5("
+    "title, description, tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "INSERT INTO streamada_video_search (rowid, title, description) SELECT id, title, description FROM streamada_video",
+]
+
+POSTGRES_FORWARD = [
+    "CREATE TABLE streamada_video_search ("
+    "video_id bigint PRIMARY KEY REFERENCES streamada_video (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+    "document tsvector NOT NULL)",
+    "CREATE INDEX streamada_video_search_document ON streamada_video_search USING GIN (document)",
+    "INSERT INTO streamada_video_search (video_id, document) SELECT id, "
+    "setweight(to_tsvector('simple', title), 'A') || setweight(to_tsvector('simple', coalesce(description, '')), 'B') "
+    "FROM streamada_video",
+]
+
+
+
+def create_search_index(apps, schema_editor):
+    statements = {'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRES_FORWARD}.get(schema_editor.connection.vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute('DROP TABLE IF EXISTS streamada_video_search')
+
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streamada', '0020_video_api_fragment'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:51
+
+import os
+from django.db import migrations, models
+
+
+# the rendition ladder when this migration was written => label, width, height
+RENDITION_LADDER = [('480p', 852, 480), ('720p', 1280, 720), ('1080p', 1920, 1080)]
+
+
+def record_existing_renditions(apps, schema_editor):
+    # the API used to guess the files of ready videos from their name, now it only reads done renditions
+    Video = apps.get_model('streamada', 'Video')
+    VideoRendition = apps.get_model('streamada', 'VideoRendition')
+    for video in Video.objects.filter(is_ready=True).exclude(video_file='').iterator():
+        base_name = os.path.splitext(video.video_file.name)[0]
+        ladder = [step for step in RENDITION_LADDER if not video.height or step[2] <= video.height]
+        for label, width, height in ladder or RENDITION_LADDER[:1]:
+            rendition, _ = VideoRendition.objects.get_or_create(video=video, label=label)
+            if rendition.status == 'done' and rendition.path:
+                continue
+            rendition.status = 'done'
+            rendition.path = rendition.path or f'{base_name}_{label}.mp4'
+            rendition.codec, rendition.width, rendition.height = 'h264', width, height
+            rendition.save()
+    # the stored API fragments get the new renditions field when they are read next
+    Video.objects.update(api_fragment='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streamada', '0021_video_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videorendition',
+            name='bitrate',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='videorendition',
+            name='codec',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='videorendition',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='videorendition',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(record_existing_renditions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.1.1 on 2026-10-18 14:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streamada', '0022_videorendition_format'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='video',
+            name='audio_codec',
+            field=models.CharField(blank=True, editable=False, max_length=32),
+        ),
+        migrations.AlterField(
+            model_name='video',
+            name='bitrate',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='video',
+            name='duration',
+            field=models.DurationField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='video',
+            name='frame_rate',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='video',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='video',
+            name='is_ready',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='video',
+            name='preview_ready',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='video',
+            name='trickplay_sheets',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='video',
+            name='video_codec',
+            field=models.CharField(blank=True, editable=False, max_length=32),
+        ),
+        migrations.AlterField(
+            model_name='video',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 14:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streamada', '0023_video_pipeline_fields_not_editable'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='reconcile_attempts',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -1,5 +1,8 @@
 from django.db import models
+from django.dispatch import Signal
 import os
+import re
+import uuid
 from django.conf import settings
 
 
@@ -14,6 +17,71 @@ GENRE_CHOICES = [
     ('Abstract', 'Abstract'),
 ]
 
+VIDEO_RENDITIONS = [
+    ('hd480', '480p'),
+    ('hd720', '720p'),
+    ('hd1080', '1080p'),
+]
+
+RENDITION_SIZES = {
+    'hd480': (852, 480),
+    'hd720': (1280, 720),
+    'hd1080': (1920, 1080),
+}
+
+RENDITION_LABEL_SIZES = {label: RENDITION_SIZES[resolution] for resolution, label in VIDEO_RENDITIONS}
+
+# codec of the renditions as ffprobe names it, every encoder of the pipeline uses libx264
+RENDITION_CODEC = 'h264'
+
+
+
+# published media carries a version in its name => videos/clip_720p.3f2a9c1d0b7e4a65.mp4,
+# a new version always gets a new name, so the files can be cached forever
+MEDIA_VERSION_LENGTH = 16
+VERSIONED_MEDIA_NAME = re.compile(rf'\.[0-9a-f]{{{MEDIA_VERSION_LENGTH}}}\.[^./]+$')
+
+
+
+# sent by the transcode jobs after they update a video with a queryset update(), which sends no post_save
+video_changed = Signal()
+
+
+
+def versioned_name(name, version):
+    base_name, extension = os.path.splitext(name)
+    return f"{base_name}.{version[:MEDIA_VERSION_LENGTH]}{extension}"
+
+
+
+def is_versioned_name(name):
+    return bool(VERSIONED_MEDIA_NAME.search(name))
+
+
+
+def thumbnail_upload_to(instance, filename):
+    """Every thumbnail upload gets a fresh version, so a replaced thumbnail never reuses a cached URL"""
+    return versioned_name(os.path.join('thumbnails', filename), uuid.uuid4().hex)
+
+
+
+def sibling_name(name, suffix):
+    """A file next to an upload whatever its extension => videos/clip.MOV and _720p.mp4 give videos/clip_720p.mp4"""
+    return os.path.splitext(name)[0] + suffix
+
+
+
+def select_renditions(source_height):
+    """
+    Returns the renditions that are not above the source height, at least the lowest one.
+    Without a probed height the full ladder is used.
+    """
+    if not source_height:
+        return list(VIDEO_RENDITIONS)
+    renditions = [(resolution, label) for resolution, label in VIDEO_RENDITIONS
+                  if RENDITION_SIZES[resolution][1] <= source_height]
+    return renditions or VIDEO_RENDITIONS[:1]
+
 
 
 class Video(models.Model):
@@ -21,18 +89,63 @@ class Video(models.Model):
     description = models.TextField(max_length=360, blank=True, null=True)
     genre = models.CharField(max_length=100, choices=GENRE_CHOICES)
     video_file = models.FileField(upload_to='videos/')
-    thumbnail = models.ImageField(upload_to='thumbnails/', blank=True, null=True)
+    thumbnail = models.ImageField(upload_to=thumbnail_upload_to, blank=True, null=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
     add_to_new_video_feed = models.BooleanField(default=False)
+    # written by the workers with update(), a form or an API save must not write a stale copy back
+    is_ready = models.BooleanField(default=False, editable=False)
+    preview_ready = models.BooleanField(default=False, editable=False)
+    trickplay_sheets = models.PositiveIntegerField(default=0, editable=False)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True, editable=False)
+    duration = models.DurationField(blank=True, null=True, editable=False)
+    width = models.PositiveIntegerField(blank=True, null=True, editable=False)
+    height = models.PositiveIntegerField(blank=True, null=True, editable=False)
+    frame_rate = models.FloatField(blank=True, null=True, editable=False)
+    bitrate = models.PositiveIntegerField(blank=True, null=True, editable=False)
+    video_codec = models.CharField(max_length=32, blank=True, editable=False)
+    audio_codec = models.CharField(max_length=32, blank=True, editable=False)
+    # how often reconcile_transcodes re-enqueued the jobs of the video
+    reconcile_attempts = models.PositiveIntegerField(default=0, editable=False)
+    # VideoSerializer output without the request dependent fields and those fields with unsigned URLs,
+    # written by store_video_fragment whenever the video changes, the API splices them into its responses
+    api_fragment = models.TextField(blank=True, editable=False)
+    media_urls = models.JSONField(default=dict, blank=True, editable=False)
+
+    class Meta:
+        # one per filter of the video list, each in the order of VideoCursorPagination
+        indexes = [
+            models.Index(fields=['-uploaded_at', '-id'], name='video_uploaded_idx'),
+            models.Index(fields=['genre', '-uploaded_at', '-id'], name='video_genre_uploaded_idx'),
+            models.Index(fields=['add_to_new_video_feed', '-uploaded_at', '-id'], name='video_feed_uploaded_idx'),
+        ]
 
     def __str__(self):
         return f"[Genre]: {self.genre},  [Title]: {self.title}"
     
 
 
+    @property
+    def rendition_ladder(self):
+        return select_renditions(self.height)
+
+    def ready_renditions(self):
+        """label => done rendition, read from the prefetched renditions"""
+        return {rendition.label: rendition for rendition in self.renditions.all()
+                if rendition.status == VideoRendition.DONE and rendition.path}
+
+    def rendition_name(self, label):
+        """Media relative file of a finished rendition or of the preview (label 'preview'), '' while there is none"""
+        if label == 'preview':
+            return sibling_name(self.video_file.name, '_preview.mp4') if self.preview_ready else ''
+        if not self.is_ready:
+            return ''
+        rendition = self.ready_renditions().get(label)
+        return rendition.path if rendition else ''
+
     def get_video_version_url(self, resolution):
-        base_name = os.path.splitext(self.video_file.name)[0]
-        version_filename = f"{base_name}_{resolution}.mp4"
+        version_filename = self.rendition_name(resolution)
+        if not version_filename:
+            return ''
         return f"{settings.MEDIA_URL}{version_filename}"
 
     @property
@@ -47,6 +160,42 @@ class Video(models.Model):
     def video_1080p_url(self):
         return self.get_video_version_url('1080p')
     
+    @property
+    def rendition_sources(self):
+        """The done renditions, lowest first, with their format => a player can pick one without probing the files"""
+        if not self.is_ready:
+            return []
+        ready = self.ready_renditions()
+        return [
+            {'label': label, 'codec': ready[label].codec, 'width': ready[label].width, 'height': ready[label].height,
+             'bitrate': ready[label].bitrate, 'size': ready[label].size, 'url': f"{settings.MEDIA_URL}{ready[label].path}"}
+            for _, label in VIDEO_RENDITIONS if label in ready
+        ]
+
+    @property
+    def preview_url(self):
+        return self.get_video_version_url('preview')
+
+    @property
+    def manifest_url(self):
+        if not self.is_ready:
+            return ''
+        base_name = os.path.splitext(self.video_file.name)[0]
+        return f"{settings.MEDIA_URL}{base_name}_hls/master.m3u8"
+
+    @property
+    def trickplay_vtt_url(self):
+        if not self.trickplay_sheets:
+            return ''
+        base_name = os.path.splitext(self.video_file.name)[0]
+        return f"{settings.MEDIA_URL}{base_name}_trickplay/thumbnails.vtt"
+
+    @property
+    def trickplay_sprite_urls(self):
+        base_name = os.path.splitext(self.video_file.name)[0]
+        return [f"{settings.MEDIA_URL}{base_name}_trickplay/sprite_{sheet:03d}.jpg"
+                for sheet in range(1, self.trickplay_sheets + 1)]
+
     @property
     def thumbnail_url(self):
         if self.thumbnail:
@@ -55,4 +204,105 @@ class Video(models.Model):
 
 
 
+class VideoRendition(models.Model):
+    """
+    State of one rendition of a video, written by the transcode jobs so that reconcile_transcodes
+    can re-enqueue only the renditions that are missing or failed. A done rendition knows its file and format,
+    the API only advertises those and never looks at the disk.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='renditions')
+    label = models.CharField(max_length=16)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    job_id = models.CharField(max_length=64, blank=True)
+    size = models.PositiveBigIntegerField(blank=True, null=True)
+    codec = models.CharField(max_length=32, blank=True)
+    width = models.PositiveIntegerField(blank=True, null=True)
+    height = models.PositiveIntegerField(blank=True, null=True)
+    # average bits per second of the file
+    bitrate = models.PositiveIntegerField(blank=True, null=True)
+    checksum = models.CharField(max_length=64, blank=True)
+    path = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['video', 'label'], name='unique_video_rendition'),
+        ]
+
+    def __str__(self):
+        return f"[Video]: {self.video_id},  [Rendition]: {self.label},  [Status]: {self.status}"
+
+
+
+class MediaTombstone(models.Model):
+    """
+    Files of a deleted video that are still on disk, purge_media_tombstones removes them in batches.
+    """
+    video_file = models.CharField(max_length=255, blank=True)
+    thumbnail = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"[Tombstone]: {self.video_file}"
+
+
+
+class VideoUpload(models.Model):
+    """
+    A resumable upload in the style of tus. The chunks are written straight into a preallocated file
+    in UPLOAD_CHUNK_DIR, received_ranges holds the [start, end) byte ranges that already arrived.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='video_uploads')
+    filename = models.CharField(max_length=255)
+    length = models.PositiveBigIntegerField()
+    received_ranges = models.JSONField(default=list)
+    metadata = models.JSONField(default=dict)
+    video = models.OneToOneField(Video, on_delete=models.SET_NULL, blank=True, null=True, related_name='upload')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"[Upload]: {self.filename},  [Received]: {self.received_bytes}/{self.length}"
+
+    @property
+    def path(self):
+        return os.path.join(settings.UPLOAD_CHUNK_DIR, f'{self.id}.part')
+
+    @property
+    def received_bytes(self):
+        return sum(end - start for start, end in self.received_ranges)
+
+    @property
+    def offset(self):
+        """End of the contiguous bytes from the start of the file, the tus Upload-Offset"""
+        if self.received_ranges and self.received_ranges[0][0] == 0:
+            return self.received_ranges[0][1]
+        return 0
+
+    @property
+    def is_complete(self):
+        return self.received_ranges == [[0, self.length]]
+
+    def add_range(self, start, end):
+        """Merges a received byte range into received_ranges"""
+        ranges = sorted(self.received_ranges + [[start, end]])
+        merged = [ranges[0]]
+        for range_start, range_end in ranges[1:]:
+            if range_start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], range_end)
+            else:
+                merged.append([range_start, range_end])
+        self.received_ranges = merged
 
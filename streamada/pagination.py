@@ -0,0 +1,14 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+
+class VideoCursorPagination(CursorPagination):
+    """
+    Newest videos first. The cursor continues behind the last uploaded_at of the page, so every page is an index
+    range scan of the same cost, no matter how deep the client pages or how large the catalog grows.
+    """
+    ordering = ('-uploaded_at', '-id')
+    page_size = settings.VIDEO_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.VIDEO_MAX_PAGE_SIZE
@@ -0,0 +1,91 @@
+import time
+from contextlib import contextmanager
+from django.core.cache import cache
+
+
+PROGRESS_TIMEOUT = 60 * 60 * 24
+PROGRESS_INTERVAL = 1
+
+
+
+def progress_key(video_id, label):
+    return f'transcode-progress:{video_id}:{label}'
+
+
+
+def get_progress(video_id, labels):
+    """
+    Returns the stored progress for every label, labels without a running job are reported as pending.
+    """
+    stored = cache.get_many([progress_key(video_id, label) for label in labels])
+    return {label: stored.get(progress_key(video_id, label), {'state': 'pending'}) for label in labels}
+
+
+
+class TranscodeProgress:
+    """
+    Collects the -progress output of one or more ffmpeg processes that work on the same video
+    and stores percent, fps, speed and ETA in Redis for every label they produce.
+    Parallel processes (like the chunks of convert_video_chunked) report as separate parts and are summed up.
+    """
+
+    def __init__(self, video_id, labels, duration_seconds=None):
+        self.video_id = video_id
+        self.labels = list(labels)
+        self.duration_seconds = duration_seconds
+        self.parts = {}
+        self.last_write = 0
+
+    def update(self, part, out_seconds, fps, speed):
+        self.parts[part] = (out_seconds, fps, speed)
+        if time.monotonic() - self.last_write >= PROGRESS_INTERVAL:
+            self.write('running')
+
+    def end_part(self, part):
+        # a finished process keeps its encoded seconds but no longer adds to fps and speed
+        out_seconds = self.parts.get(part, (0, 0, 0))[0]
+        self.parts[part] = (out_seconds, 0, 0)
+
+    def finish(self, failed=False):
+        self.write('failed' if failed else 'done')
+
+    def write(self, state):
+        self.last_write = time.monotonic()
+        done_seconds = sum(out_seconds for out_seconds, _, _ in self.parts.values())
+        speed = sum(part_speed for _, _, part_speed in self.parts.values())
+        data = {
+            'state': state,
+            'percent': None,
+            'fps': round(sum(fps for _, fps, _ in self.parts.values()), 1),
+            'speed': round(speed, 2),
+            'eta_seconds': None,
+            'updated_at': time.time(),
+        }
+        if state == 'done':
+            data['percent'] = 100.0
+            data['eta_seconds'] = 0
+        elif self.duration_seconds:
+            data['percent'] = round(min(done_seconds / self.duration_seconds, 1) * 100, 1)
+            if speed:
+                data['eta_seconds'] = round(max(self.duration_seconds - done_seconds, 0) / speed)
+
+        cache.set_many({progress_key(self.video_id, label): data for label in self.labels}, PROGRESS_TIMEOUT)
+
+
+
+@contextmanager
+def track_progress(video_id, labels, duration_seconds=None):
+    """
+    Yields a TranscodeProgress for the video (None without a video) and marks its labels as done or failed at the end.
+    """
+    if video_id is None:
+        yield None
+        return
+
+    progress = TranscodeProgress(video_id, labels, duration_seconds)
+    try:
+        yield progress
+    except Exception:
+        progress.finish(failed=True)
+        raise
+    progress.finish()
@@ -0,0 +1,81 @@
+import re
+from django.conf import settings
+from django.db import NotSupportedError, connection
+
+
+# full-text index of the video titles and descriptions, an FTS5 table on SQLite and a tsvector table on PostgreSQL
+SEARCH_TABLE = 'streamada_video_search'
+
+# 'simple' does not stem, so a prefix typed in the search box still matches the indexed words
+POSTGRES_SEARCH_CONFIG = 'simple'
+
+# a title match outweighs a description match, ts_rank takes the weight of the description relative to the title
+TITLE_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+MAX_SEARCH_TERMS = 8
+
+
+
+def search_terms(query):
+    """The words of a search query => 'Crime  sto' gives ['Crime', 'sto'], punctuation never reaches the index"""
+    return re.findall(r'[^\W_]+', query)[:MAX_SEARCH_TERMS]
+
+
+
+def index_video(video):
+    """Writes the title and description of a video to the search index, in the transaction of the save"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [video.pk])
+            cursor.execute(f'INSERT INTO {SEARCH_TABLE} (rowid, title, description) VALUES (%s, %s, %s)',
+                           [video.pk, video.title, video.description])
+        elif connection.vendor == 'postgresql':
+            cursor.execute(
+                f"INSERT INTO {SEARCH_TABLE} (video_id, document) VALUES (%s, "
+                f"setweight(to_tsvector('{POSTGRES_SEARCH_CONFIG}', %s), 'A') || "
+                f"setweight(to_tsvector('{POSTGRES_SEARCH_CONFIG}', coalesce(%s, '')), 'B')) "
+                f"ON CONFLICT (video_id) DO UPDATE SET document = EXCLUDED.document",
+                [video.pk, video.title, video.description])
+
+
+
+def unindex_video(video_id):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [video_id])
+        elif connection.vendor == 'postgresql':
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE video_id = %s', [video_id])
+
+
+
+def search_videos(query, genre=None, limit=None):
+    """
+    Ids of the videos whose title or description contain every word of query, best match first.
+    Every word is matched as a prefix, so 'cri sto' finds 'Crime Story' while it is typed.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return []
+    genre_filter = 'AND video.genre = %s' if genre else ''
+    params = [genre] if genre else []
+
+    if connection.vendor == 'sqlite':
+        match = ' '.join(f'"{term}"*' for term in terms)
+        sql = (f'SELECT video.id FROM {SEARCH_TABLE} JOIN streamada_video video ON video.id = {SEARCH_TABLE}.rowid '
+               f'WHERE {SEARCH_TABLE} MATCH %s {genre_filter} '
+               f'ORDER BY bm25({SEARCH_TABLE}, {TITLE_WEIGHT}, {DESCRIPTION_WEIGHT}), video.uploaded_at DESC '
+               f'LIMIT %s')
+    elif connection.vendor == 'postgresql':
+        match = ' & '.join(f'{term}:*' for term in terms)
+        sql = (f"SELECT video.id FROM {SEARCH_TABLE} search JOIN streamada_video video ON video.id = search.video_id, "
+               f"to_tsquery('{POSTGRES_SEARCH_CONFIG}', %s) query "
+               f"WHERE search.document @@ query {genre_filter} "
+               f"ORDER BY ts_rank('{{0, 0, {DESCRIPTION_WEIGHT / TITLE_WEIGHT}, 1}}', search.document, query) DESC"
+               f", video.uploaded_at DESC LIMIT %s")
+    else:
+        raise NotSupportedError(f'Video search needs SQLite or PostgreSQL, not {connection.vendor}')
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [match, *params, limit or settings.VIDEO_PAGE_SIZE])
+        return [row[0] for row in cursor.fetchall()]
@@ -9,7 +9,9 @@ from django.core.mail import EmailMultiAlternatives
 from django.contrib.auth import authenticate
 from django.utils.http import urlsafe_base64_decode
 from streamada.models import Video
-from streamada.tasks import send_activation_email
+import django_rq
+from streamada.tasks import send_activation_email, send_email
+from streamada.signed_media import sign_media_url
 
 
 
@@ -118,7 +120,7 @@ class PasswordResetSerializer(serializers.Serializer):
             to=recipient_list
         )
         email_message.attach_alternative(html_message, "text/html")
-        email_message.send()
+        django_rq.get_queue('email').enqueue(send_email, email_message)
 
         return {'uid': uid, 'token': token}
     
@@ -154,32 +156,100 @@ class VideoSerializer(serializers.ModelSerializer):
     video_480p_url = serializers.SerializerMethodField()
     video_720p_url = serializers.SerializerMethodField()
     video_1080p_url = serializers.SerializerMethodField()
+    manifest_url = serializers.SerializerMethodField()
+    preview_url = serializers.SerializerMethodField()
+    trickplay_vtt_url = serializers.SerializerMethodField()
+    trickplay_sprite_urls = serializers.SerializerMethodField()
     thumbnail_url = serializers.SerializerMethodField()
+    renditions = serializers.SerializerMethodField()
 
     class Meta:
         model = Video
         fields = [
             'id', 'title', 'description', 'genre',
-            'video_480p_url', 'video_720p_url', 'video_1080p_url', 'thumbnail_url', 'add_to_new_video_feed',
-            'video_file'
+            'video_480p_url', 'video_720p_url', 'video_1080p_url', 'manifest_url', 'preview_url',
+            'trickplay_vtt_url', 'trickplay_sprite_urls', 'thumbnail_url', 'renditions', 'add_to_new_video_feed',
+            'video_file', 'is_ready', 'preview_ready', 'duration'
         ]
+        read_only_fields = ['is_ready', 'preview_ready', 'duration']
+
+    def update(self, instance, validated_data):
+        """Saves only the fields of the request, the workers update the pipeline fields of the same row meanwhile"""
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        instance.save(update_fields=list(validated_data))
+        return instance
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if self.context.get('sign_media', True):
+            sign_media_fields(data, self.context.get('request'))
+        return data
 
     def get_video_480p_url(self, obj):
-        request = self.context.get('request')
-        url = obj.video_480p_url
-        return request.build_absolute_uri(url) if request else url
+        return obj.video_480p_url
 
     def get_video_720p_url(self, obj):
-        request = self.context.get('request')
-        url = obj.video_720p_url
-        return request.build_absolute_uri(url) if request else url
+        return obj.video_720p_url
 
     def get_video_1080p_url(self, obj):
-        request = self.context.get('request')
-        url = obj.video_1080p_url
-        return request.build_absolute_uri(url) if request else url
+        return obj.video_1080p_url
+
+    def get_manifest_url(self, obj):
+        return obj.manifest_url
+
+    def get_preview_url(self, obj):
+        return obj.preview_url
+
+    def get_trickplay_vtt_url(self, obj):
+        return obj.trickplay_vtt_url
+
+    def get_trickplay_sprite_urls(self, obj):
+        return obj.trickplay_sprite_urls
 
     def get_thumbnail_url(self, obj):
-        request = self.context.get('request')
-        url = obj.thumbnail_url
-        return request.build_absolute_uri(url) if request and url else url
\ No newline at end of file
+        return obj.thumbnail_url
+
+    def get_renditions(self, obj):
+        return obj.rendition_sources
+
+
+
+# media fields of VideoSerializer => True if the URL is signed for its folder (playlists, VTT and sprites)
+SIGNED_MEDIA_FIELDS = {
+    'video_480p_url': False,
+    'video_720p_url': False,
+    'video_1080p_url': False,
+    'manifest_url': True,
+    'preview_url': False,
+    'trickplay_vtt_url': True,
+    'trickplay_sprite_urls': True,
+    'thumbnail_url': False,
+    'renditions': False,
+}
+
+
+
+def signed_url(url, directory=False, origin=''):
+    return origin + sign_media_url(url, directory) if url else url
+
+
+
+def sign_media_fields(data, request=None):
+    """
+    Replaces the media URLs of serialized video data with signed ones. The feed caches the unsigned data
+    (context sign_media=False) and signs it for every response, a signature never ends up in the cache.
+    """
+    # scheme and host once per video instead of once per URL
+    origin = request.build_absolute_uri('/')[:-1] if request else ''
+    for field, directory in SIGNED_MEDIA_FIELDS.items():
+        if field not in data:
+            continue
+        if field == 'renditions':
+            data[field] = [{**rendition, 'url': signed_url(rendition['url'], directory, origin)}
+                           for rendition in data[field]]
+        elif isinstance(data[field], list):
+            data[field] = [signed_url(url, directory, origin) for url in data[field]]
+        else:
+            data[field] = signed_url(data[field], directory, origin)
+    return data
@@ -1,9 +1,25 @@
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch import receiver
-from streamada.models import Video
-import os
+from streamada.models import Video, MediaTombstone, video_changed, sibling_name
 import django_rq
-from streamada.tasks import convert_video, delete_original_file
+from django.db import transaction
+from streamada.tasks import enqueue_conversion, hash_upload, reuse_existing_renditions
+from streamada.uploadhandlers import file_sha256
+from streamada.storage import schedule_media_purge
+from streamada.feed import refresh_feed
+from streamada.cache import bump_video_cache_version
+from streamada.fragments import store_video_fragment
+from streamada.search import index_video, unindex_video
+
+
+
+@receiver(pre_save, sender=Video)
+def hash_uploaded_video(sender, instance, **kwargs):
+    """Store the sha256 of a new upload, the hashing upload handlers already computed it while streaming"""
+
+    if instance.video_file and not instance.video_file._committed:
+        upload = instance.video_file.file
+        instance.content_hash = getattr(upload, 'content_hash', None) or file_sha256(upload)
 
 
 
@@ -12,41 +28,77 @@ def video_post_save(sender, instance, created, **kwargs):
     if created:
         print('New Video created')
 
-        video_base_path = (instance.video_file.path.replace('.mp4', ''))
-        versions = ['_480p.mp4', '_720p.mp4', '_1080p.mp4']
+        if reuse_existing_renditions(instance):
+            return
 
-        for version in versions:
-            version_path = video_base_path + version
-            if os.path.isfile(version_path):
-                raise ValueError(f"The file '{version_path}' already exists. Please remove it before uploading a new video.")
+        # the renditions are written next to the upload, clip.mp4 and clip.MOV would share them
+        base_name = sibling_name(instance.video_file.name, '')
+        others = (Video.objects.filter(video_file__startswith=f'{base_name}.').exclude(pk=instance.pk)
+                  .values_list('video_file', flat=True))
+        if any(sibling_name(name, '') == base_name for name in others):
+            raise ValueError(f"The renditions of '{base_name}' already exist. Please rename the video before uploading it.")
 
-        # RQ-Queue, get the default worker
-        queue = django_rq.get_queue('default')
+        # admin saves and assemble_upload run in a transaction, a worker must not see the job before the row
+        video_id, video_path, at_front = instance.id, instance.video_file.path, instance.add_to_new_video_feed
+        if instance.content_hash:
+            transaction.on_commit(lambda: enqueue_conversion(video_id, video_path, at_front))
+        else:
+            # assembled resumable uploads are hashed by a worker, not in the request that completes them
+            transaction.on_commit(lambda: django_rq.get_queue('transcode').enqueue(
+                hash_upload, video_id, video_path, at_front=at_front))
 
-        # manage the queue
-        video_path = (instance.video_file.path)
-        job_480p = queue.enqueue(convert_video, video_path, 'hd480', '480p')
-        job_720p = queue.enqueue(convert_video, video_path, 'hd720', '720p', depends_on=job_480p)
-        job_1080p = queue.enqueue(convert_video, video_path, 'hd1080', '1080p', depends_on=job_720p)
 
-        queue.enqueue(delete_original_file, video_path, depends_on=job_1080p)
 
+@receiver(post_delete, sender=Video)
+def auto_delete_file_on_delete(sender, instance, *args, **kwargs):
+    """
+    Writes a tombstone for the files of the video, purge_media_tombstones removes them in batches after the commit,
+    so deleting many videos from the admin does not wait for the disk
+    """
+    MediaTombstone.objects.create(video_file=instance.video_file.name or '', thumbnail=instance.thumbnail.name or '')
+    transaction.on_commit(schedule_media_purge)
 
 
 
+@receiver(post_save, sender=Video)
+def store_fragment_on_save(sender, instance, **kwargs):
+    """Serializes the video for the API once per change, in the same transaction as the change"""
+    store_video_fragment(instance.pk)
+
+
+
+@receiver(video_changed, sender=Video)
+def store_fragment_on_transcode(sender, video_id, **kwargs):
+    store_video_fragment(video_id)
+
+
+
+@receiver(post_save, sender=Video)
+def index_video_on_save(sender, instance, **kwargs):
+    index_video(instance)
+
+
 
 @receiver(post_delete, sender=Video)
-def auto_delete_file_on_delete(sender, instance, *args, **kwargs):
-    """Delete all 3 versions and the Thumbnail from the system"""
-
-    video_base_path = instance.video_file.path.replace('.mp4', '')
-    versions = ['_480p.mp4', '_720p.mp4', '_1080p.mp4']
-    for version in versions:
-        version_path = video_base_path + version
-        if os.path.isfile(version_path):
-            os.remove(version_path)
-        
-        if instance.thumbnail:
-            if os.path.isfile(instance.thumbnail.path):
-                os.remove(instance.thumbnail.path)
-            
\ No newline at end of file
+def unindex_video_on_delete(sender, instance, **kwargs):
+    unindex_video(instance.pk)
+
+
+
+@receiver(post_save, sender=Video)
+@receiver(post_delete, sender=Video)
+def refresh_caches_on_save(sender, instance, **kwargs):
+    """
+    Rebuilds the home feed rows of the video and bumps the version of the cached API responses once the change
+    is committed, a response cached before the commit is never served again
+    """
+    video_id = instance.pk
+    transaction.on_commit(lambda: refresh_feed(video_id))
+    transaction.on_commit(bump_video_cache_version)
+
+
+
+@receiver(video_changed, sender=Video)
+def refresh_caches_on_transcode(sender, video_id, **kwargs):
+    transaction.on_commit(lambda: refresh_feed(video_id))
+    transaction.on_commit(bump_video_cache_version)
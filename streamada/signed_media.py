@@ -0,0 +1,68 @@
+import base64
+import hashlib
+import hmac
+import posixpath
+import time
+from functools import lru_cache
+from urllib.parse import quote, unquote
+from django.conf import settings
+from django.urls import get_script_prefix, reverse
+from django.utils.crypto import constant_time_compare
+from django.utils.http import RFC3986_SUBDELIMS
+
+
+
+@lru_cache
+def media_signing_key(secret_key):
+    # the key salted_hmac('streamada.signed_media', ..., algorithm='sha256') derives on every call
+    return hashlib.sha256(f'streamada.signed_media{secret_key}'.encode()).digest()
+
+
+
+def media_signature(expires, scope):
+    key = media_signing_key(settings.SECRET_KEY)
+    digest = hmac.new(key, f'{expires}:{scope}'.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).decode().rstrip('=')
+
+
+
+def sign_media_url(url, directory=False):
+    """
+    Turns a MEDIA_URL url into a signed one that expires after MEDIA_URL_TTL seconds. The expiry is rounded up
+    to MEDIA_URL_BUCKET, so the URL stays the same for a while and browsers can cache the media.
+    With directory the signature covers the folder of the file, so the relative references of
+    HLS playlists and WebVTT tracks resolve to signed URLs as well.
+    """
+    name = unquote(url[len(settings.MEDIA_URL):])
+    bucket = settings.MEDIA_URL_BUCKET
+    expires = -(-(int(time.time()) + settings.MEDIA_URL_TTL) // bucket) * bucket
+    parts = name.split('/')
+    depth = len(parts) - 1 if directory else len(parts)
+    token = f"{expires}-{depth}-{media_signature(expires, '/'.join(parts[:depth]))}"
+    return f"{signed_media_prefix(get_script_prefix())}{token}/{quote(name, safe=RFC3986_SUBDELIMS + '/~:@')}"
+
+
+
+@lru_cache
+def signed_media_prefix(script_prefix):
+    """
+    Start of the signed-media route, resolved once. reverse() takes longer than the HMAC
+    and a list response signs about ten URLs per video.
+    """
+    return reverse('signed-media', kwargs={'token': '-', 'name': '-'})[:-len('-/-')]
+
+
+
+def verify_media_token(token, name):
+    """
+    True if the token is not expired and signs name or one of its folders, a pure CPU check without database access.
+    """
+    try:
+        expires, depth, signature = token.split('-', 2)
+        expires, depth = int(expires), int(depth)
+    except ValueError:
+        return False
+    parts = name.split('/')
+    if expires < time.time() or not 0 < depth <= len(parts) or posixpath.normpath(name) != name or '..' in parts:
+        return False
+    return constant_time_compare(signature, media_signature(expires, '/'.join(parts[:depth])))
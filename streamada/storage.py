@@ -0,0 +1,121 @@
+import glob
+import os
+import shutil
+import time
+import django_rq
+from django.conf import settings
+from django.core.cache import cache
+from streamada.models import Video, VideoRendition, MediaTombstone, VIDEO_RENDITIONS, MEDIA_VERSION_LENGTH
+
+
+MEDIA_PURGE_SCHEDULED_KEY = 'media-purge-scheduled'
+MEDIA_PURGE_SCHEDULED_TIMEOUT = 60 * 60
+
+# everything the pipeline writes next to an upload, including the work files of running jobs
+MEDIA_SUFFIXES = [
+    '_preview.mp4', '_audio.m4a', '_audio.tmp.m4a', '_hls', '_trickplay', '_chunks',
+    *[f'_{label}.mp4' for _, label in VIDEO_RENDITIONS],
+]
+
+
+
+def video_media_paths(video_file):
+    """
+    All files and folders that belong to a video_file name like => videos/clip.mp4
+    """
+    path = os.path.normpath(os.path.join(settings.MEDIA_ROOT, video_file))
+    base_path = os.path.splitext(path)[0]
+    return [path] + [base_path + suffix for suffix in MEDIA_SUFFIXES]
+
+
+
+def versioned_media_paths(video_file):
+    """
+    The renditions of a video_file with a version in their name like => videos/clip_720p.3f2a9c1d0b7e4a65.mp4
+    """
+    base_path = glob.escape(os.path.splitext(os.path.normpath(os.path.join(settings.MEDIA_ROOT, video_file)))[0])
+    version = '[0-9a-f]' * MEDIA_VERSION_LENGTH
+    return sorted(path for _, label in VIDEO_RENDITIONS for path in glob.glob(f'{base_path}_{label}.{version}.mp4'))
+
+
+
+def media_path_size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(folder, name))
+                   for folder, _, names in os.walk(path) for name in names)
+    return os.path.getsize(path) if os.path.isfile(path) else 0
+
+
+
+def remove_media_path(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.isfile(path):
+        os.remove(path)
+
+
+
+def schedule_media_purge():
+    """
+    Enqueues purge_media_tombstones unless a purge is already waiting, so a bulk delete enqueues only one job.
+    """
+    if cache.add(MEDIA_PURGE_SCHEDULED_KEY, True, MEDIA_PURGE_SCHEDULED_TIMEOUT):
+        django_rq.get_queue('backfill').enqueue(purge_media_tombstones)
+
+
+
+def purge_media_tombstones(batch_size=None):
+    """
+    RQ job that removes the files of up to MEDIA_PURGE_BATCH deleted videos and enqueues itself again
+    while tombstones are left. Media that a deduplicated video still uses is kept.
+    """
+    cache.delete(MEDIA_PURGE_SCHEDULED_KEY)
+    batch_size = batch_size or settings.MEDIA_PURGE_BATCH
+    tombstones = list(MediaTombstone.objects.order_by('id')[:batch_size])
+
+    video_files = {tombstone.video_file for tombstone in tombstones if tombstone.video_file}
+    in_use = set(Video.objects.filter(video_file__in=video_files).values_list('video_file', flat=True))
+    for tombstone in tombstones:
+        if tombstone.video_file and tombstone.video_file not in in_use:
+            for path in video_media_paths(tombstone.video_file) + versioned_media_paths(tombstone.video_file):
+                remove_media_path(path)
+        if tombstone.thumbnail:
+            remove_media_path(os.path.join(settings.MEDIA_ROOT, tombstone.thumbnail))
+    MediaTombstone.objects.filter(pk__in=[tombstone.pk for tombstone in tombstones]).delete()
+
+    if len(tombstones) == batch_size:
+        schedule_media_purge()
+    return len(tombstones)
+
+
+
+def find_orphaned_media(min_age_seconds=0):
+    """
+    Returns (path, bytes) for every entry of MEDIA_ROOT/videos and MEDIA_ROOT/thumbnails that no video references.
+    Entries younger than min_age_seconds are skipped, they can belong to an upload that is still being saved.
+    Files of tombstones are left to purge_media_tombstones. Older versions of a rendition count as orphaned.
+    """
+    referenced = set()
+    for model in (Video, MediaTombstone):
+        for video_file, thumbnail in model.objects.values_list('video_file', 'thumbnail').iterator():
+            if video_file:
+                referenced.update(video_media_paths(video_file))
+            if thumbnail:
+                referenced.add(os.path.normpath(os.path.join(settings.MEDIA_ROOT, thumbnail)))
+    for path in VideoRendition.objects.exclude(path='').values_list('path', flat=True).iterator():
+        referenced.add(os.path.normpath(os.path.join(settings.MEDIA_ROOT, path)))
+    for video_file in MediaTombstone.objects.exclude(video_file='').values_list('video_file', flat=True).iterator():
+        referenced.update(versioned_media_paths(video_file))
+
+    newest = time.time() - min_age_seconds
+    orphans = []
+    for folder in ['videos', 'thumbnails']:
+        directory = os.path.join(settings.MEDIA_ROOT, folder)
+        if not os.path.isdir(directory):
+            continue
+        for entry in os.scandir(directory):
+            path = os.path.normpath(entry.path)
+            if path in referenced or entry.stat(follow_symlinks=False).st_mtime > newest:
+                continue
+            orphans.append((path, media_path_size(path)))
+    return sorted(orphans)
@@ -0,0 +1,115 @@
+import mimetypes
+import os
+from urllib.parse import quote
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from streamada.models import is_versioned_name
+
+
+# a versioned name never gets other content, browsers and CDNs keep it without revalidating
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+
+def parse_byte_range(header, size):
+    """
+    Returns the (first, last) byte of a single range Range header like => bytes=0-499, bytes=500-, bytes=-500
+    None means the whole file is sent: no header, a malformed one or several ranges, which browsers do not request.
+    Raises ValueError for a range that starts behind the end of the file.
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    first, dash, last = header[len('bytes='):].strip().partition('-')
+    if not dash or not (first or last) or not (first + last).isdigit():
+        return None
+    if not first:
+        # suffix range => the last bytes of the file
+        if not int(last) or not size:
+            raise ValueError('Empty suffix range')
+        return max(size - int(last), 0), size - 1
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first >= size:
+        raise ValueError('Range starts behind the end of the file')
+    if last < first:
+        return None
+    return first, last
+
+
+
+class RangeFile:
+    """
+    Read only view on length bytes of a file from start on. The file descriptor always stands at the current
+    position, so gunicorn's wsgi.file_wrapper sends the range with os.sendfile from fileno() and Content-Length,
+    servers without sendfile read it in blocks.
+    """
+
+    def __init__(self, path, start, length):
+        self.name = path
+        self.start = start
+        self.length = length
+        self.file = open(path, 'rb', buffering=0)
+        self.file.seek(start)
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def tell(self):
+        return self.file.tell() - self.start
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self.tell(), os.SEEK_END: self.length}[whence]
+        position = min(max(base + offset, 0), self.length)
+        self.file.seek(self.start + position)
+        return position
+
+    def read(self, size=-1):
+        remaining = self.length - self.tell()
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        return self.file.read(size)
+
+    def close(self):
+        self.file.close()
+
+
+
+def media_response(request, path, name):
+    """
+    Response for a media file at path (name is relative to MEDIA_ROOT) that honours Range requests.
+    With MEDIA_STREAM_MODE 'x-accel-redirect' or 'x-sendfile' the web server sends the file and handles the range.
+    """
+    response = file_response(request, path, name)
+    if response.status_code != 416 and is_versioned_name(name):
+        response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+
+def file_response(request, path, name):
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    if settings.MEDIA_STREAM_MODE == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT_PREFIX + quote(name)
+        return response
+    if settings.MEDIA_STREAM_MODE == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = path
+        return response
+
+    size = os.path.getsize(path)
+    try:
+        byte_range = parse_byte_range(request.headers.get('Range'), size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    if byte_range is None:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+    else:
+        first, last = byte_range
+        response = FileResponse(RangeFile(path, first, last - first + 1), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {first}-{last}/{size}'
+    response['Accept-Ranges'] = 'bytes'
+    return response
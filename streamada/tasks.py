@@ -1,23 +1,731 @@
 import subprocess
 import os
+import bisect
+import csv
+import time
+import struct
+import json
+import math
+import glob
+import shutil
+import tempfile
+import uuid
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import django_rq
+from rq.job import Dependency, Job, JobStatus
+from rq.exceptions import NoSuchJobError
+from django.conf import settings
+from django.core.files import File
+from django.utils import timezone
+from django.db.models import F
 from django.contrib.auth.tokens import default_token_generator
 from django.utils.http import urlsafe_base64_encode
 from django.utils.encoding import force_bytes
 from django.template.loader import render_to_string
 from django.core.mail import EmailMultiAlternatives
+from streamada.models import Video, VideoRendition, RENDITION_SIZES, select_renditions, versioned_name, video_changed
+from streamada.models import RENDITION_LABEL_SIZES, RENDITION_CODEC, sibling_name
+from streamada.progress import track_progress
+from streamada.uploadhandlers import file_sha256
 
+try:
+    import fcntl
+except ImportError:
+    # no ffmpeg slots on Windows, the RQ workers need a Unix system anyway
+    fcntl = None
 
-def convert_video(source, resolution, label):
+FFMPEG_SLOT_POLL = 0.5
+
+
+def run_ffmpeg(cmd, progress=None, part=0):
+    """
+    Runs an ffmpeg command list and reports its machine readable -progress output to progress.
+    Raises CalledProcessError with the end of the ffmpeg log if ffmpeg fails.
+    """
+    cmd = [cmd[0], '-nostats', '-progress', 'pipe:1', *cmd[1:]]
+    with ffmpeg_slot(), tempfile.TemporaryFile() as log:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=log, text=True)
+        values = {}
+        for line in process.stdout:
+            key, _, value = line.strip().partition('=')
+            values[key] = value
+            if key == 'progress' and progress is not None:
+                progress.update(part, parse_progress_number(values.get('out_time_us')) / 1000000,
+                                parse_progress_number(values.get('fps')),
+                                parse_progress_number(values.get('speed', '').rstrip('x')))
+        returncode = process.wait()
+        if progress is not None:
+            progress.end_part(part)
+
+        if returncode != 0:
+            log.seek(0)
+            raise subprocess.CalledProcessError(returncode, cmd, stderr=log.read()[-4000:].decode(errors='replace'))
+
+
+
+@contextmanager
+def ffmpeg_slot():
+    """
+    Host wide semaphore for ffmpeg processes, waits until one of the FFMPEG_MAX_PROCESSES slot files can be locked.
+    The lock belongs to the open file, so threads and worker processes compete alike
+    and the kernel frees the slot of a worker that dies.
+    """
+    if fcntl is None:
+        yield None
+        return
+
+    os.makedirs(settings.FFMPEG_SLOT_DIR, exist_ok=True)
+    while True:
+        for slot in range(settings.FFMPEG_MAX_PROCESSES):
+            with open(os.path.join(settings.FFMPEG_SLOT_DIR, f'slot_{slot}.lock'), 'w') as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                try:
+                    yield slot
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+                return
+        time.sleep(FFMPEG_SLOT_POLL)
+
+
+
+def encoder_threads(outputs=1):
+    """Threads for every encoder of an ffmpeg call, the outputs of one call share the FFMPEG_THREADS"""
+    return str(max(1, settings.FFMPEG_THREADS // outputs))
+
+
+
+def parse_progress_number(value):
+    # ffmpeg reports N/A until the first frame is encoded
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+
+def probe_video(source):
+    """
+    Reads the stream information of the source with ffprobe.
+    Returns width, height, duration, frame_rate, bitrate, video_codec and audio_codec.
+    """
+    cmd = ['ffprobe', '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', source]
+    result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    info = json.loads(result.stdout)
+
+    streams = info.get('streams', [])
+    video = next((stream for stream in streams if stream.get('codec_type') == 'video'), {})
+    audio = next((stream for stream in streams if stream.get('codec_type') == 'audio'), {})
+    file_format = info.get('format', {})
+
+    width, height = video.get('width'), video.get('height')
+    rotation = int(video.get('tags', {}).get('rotate', 0))
+    for side_data in video.get('side_data_list', []):
+        rotation = int(side_data.get('rotation', rotation))
+    if rotation % 180:
+        width, height = height, width
+
+    numerator, _, denominator = video.get('avg_frame_rate', '0/0').partition('/')
+    frame_rate = float(numerator) / float(denominator) if denominator and float(denominator) else None
+    duration = file_format.get('duration') or video.get('duration')
+    bitrate = file_format.get('bit_rate') or video.get('bit_rate')
+
+    return {
+        'width': width,
+        'height': height,
+        'duration': timedelta(seconds=float(duration)) if duration else None,
+        'frame_rate': frame_rate,
+        'bitrate': int(bitrate) if bitrate else None,
+        'video_codec': video.get('codec_name', ''),
+        'audio_codec': audio.get('codec_name', ''),
+    }
+
+
+
+def encode_preview(video_id, source):
+    """
+    Very fast low quality encode on the preview queue, so a new upload is playable within seconds.
+    The quality renditions replace it once finalize_video marks the video as ready.
+    """
+    target = sibling_name(source, '_preview.mp4')
+    cmd = ['ffmpeg', '-i', source, '-vf', f'scale=-2:{settings.PREVIEW_HEIGHT}',
+           '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '30', '-threads', encoder_threads(),
+           '-c:a', 'aac', '-b:a', '96k', '-movflags', '+faststart', target]
+    with track_progress(video_id, ['preview']) as progress:
+        run_ffmpeg(cmd, progress)
+    Video.objects.filter(pk=video_id).update(preview_ready=True)
+    video_changed.send(sender=Video, video_id=video_id)
+    return target
+
+
+
+# fields that a byte-identical upload takes over from the video whose renditions it reuses
+REUSED_MEDIA_FIELDS = [
+    'video_file', 'is_ready', 'preview_ready', 'trickplay_sheets', 'duration', 'width', 'height',
+    'frame_rate', 'bitrate', 'video_codec', 'audio_codec',
+]
+
+
+
+def reuse_existing_renditions(instance):
+    """
+    Points a new upload at the finished renditions of a byte-identical video and removes the upload.
+    The renditions are shared by reference, they are only deleted with the last video that uses them.
+    """
+    if not instance.content_hash:
+        return False
+    original = (Video.objects.filter(content_hash=instance.content_hash, is_ready=True)
+                .exclude(pk=instance.pk).first())
+    if original is None:
+        return False
+
+    if os.path.isfile(instance.video_file.path):
+        os.remove(instance.video_file.path)
+    values = {field: getattr(original, field) for field in REUSED_MEDIA_FIELDS}
+    Video.objects.filter(pk=instance.pk).update(**values)
+    for field, value in values.items():
+        setattr(instance, field, value)
+    # copies of the rows with every field, so the format of the files comes along
+    renditions = list(original.renditions.filter(status=VideoRendition.DONE))
+    for rendition in renditions:
+        rendition.pk, rendition.video, rendition.job_id = None, instance, ''
+    VideoRendition.objects.bulk_create(renditions)
+    print(f'Reusing the renditions of video {original.pk} for video {instance.pk}')
+    return True
+
+
+
+def enqueue_conversion(video_id, video_path, at_front=False):
+    """
+    The preview goes first on its own queue, the probe job picks the renditions and enqueues them,
+    videos for the new video feed jump the line on both queues
+    """
+    preview_job = django_rq.get_queue('preview').enqueue(encode_preview, video_id, video_path, at_front=at_front)
+    django_rq.get_queue('transcode').enqueue(analyze_video, video_id, video_path, preview_job_id=preview_job.id,
+                                             at_front=at_front)
+
+
+
+def hash_upload(video_id, source, at_front=False):
+    """
+    First job of a video whose file was not hashed on the way in, like an assembled resumable upload.
+    Stores the sha256, then reuses the renditions of a byte-identical video or starts the conversion.
+    """
+    with open(source, 'rb') as file:
+        content_hash = file_sha256(File(file))
+    Video.objects.filter(pk=video_id).update(content_hash=content_hash)
+    video = Video.objects.filter(pk=video_id).first()
+    if video is None:
+        return
+    if reuse_existing_renditions(video):
+        video_changed.send(sender=Video, video_id=video_id)
+        return
+    enqueue_conversion(video_id, source, at_front)
+
+
+
+def analyze_video(video_id, source, preview_job_id=None, queue_name='transcode'):
+    """
+    First job of every upload, records the probe data on the video and enqueues the renditions it really needs.
+    """
+    probe = probe_video(source)
+    Video.objects.filter(pk=video_id).update(**probe)
+    video_changed.send(sender=Video, video_id=video_id)
+    duration_seconds = probe['duration'].total_seconds() if probe['duration'] else None
+    at_front = Video.objects.filter(pk=video_id, add_to_new_video_feed=True).exists()
+    return enqueue_transcode_jobs(video_id, source, select_renditions(probe['height']),
+                                  duration_seconds=duration_seconds, has_audio=bool(probe['audio_codec']),
+                                  preview_job_id=preview_job_id, queue_name=queue_name, at_front=at_front)
+
+
+
+def enqueue_transcode_jobs(video_id, source, renditions, duration_seconds=None, has_audio=True, preview_job_id=None,
+                           labels=None, queue_name='transcode', at_front=False):
+    """
+    Enqueues the rendition jobs, the HLS packaging and the finalize_video fan-in step.
+    Videos longer than VIDEO_CHUNKED_MIN_DURATION are transcoded with convert_video_chunked.
+    finalize_video also waits for the preview job, because it deletes the source the preview reads,
+    a failed preview must not keep the finished renditions from being marked ready.
+    With labels only those renditions are encoded (again), package_hls still packages all of them.
+    With at_front every job of the video is put at the front of the queue.
+    """
+    queue = django_rq.get_queue(queue_name)
+    encode = [(resolution, label) for resolution, label in renditions if labels is None or label in labels]
+
+    if not encode:
+        rendition_jobs = []
+    elif duration_seconds and duration_seconds >= settings.VIDEO_CHUNKED_MIN_DURATION:
+        rendition_jobs = [enqueue_rendition_job(queue, video_id, encode, convert_video_chunked,
+                                                source, encode, duration_seconds, has_audio, video_id=video_id,
+                                                at_front=at_front)]
+    elif settings.VIDEO_TRANSCODE_MODE == 'single_pass':
+        rendition_jobs = [enqueue_rendition_job(queue, video_id, encode, convert_video_single_pass, source, encode,
+                                                video_id=video_id, duration_seconds=duration_seconds,
+                                                has_audio=has_audio, at_front=at_front)]
+    else:
+        # every rendition is an independent job, so idle workers can pick them up at the same time,
+        # the lowest rendition also writes the trickplay sprites from its decode,
+        # the audio is encoded once before them and copied into every rendition
+        audio_job = queue.enqueue(encode_audio, source, at_front=at_front) if has_audio else None
+        rendition_jobs = [
+            enqueue_rendition_job(queue, video_id, [(resolution, label)], convert_video, source, resolution, label,
+                                  video_id=video_id, duration_seconds=duration_seconds, trickplay=(index == 0),
+                                  audio=audio_path(source) if has_audio else None,
+                                  depends_on=audio_job, at_front=at_front)
+            for index, (resolution, label) in enumerate(encode)
+        ]
+
+    hls_job = queue.enqueue(package_hls, source, renditions, video_id=video_id, depends_on=rendition_jobs,
+                            at_front=at_front)
+    finalize_dependencies = [*rendition_jobs, hls_job]
+    if preview_job_id:
+        # RQ applies allow_failure to every dependency of a job, so only this step tolerates a failed preview
+        finalize_dependencies.append(queue.enqueue(preview_settled, video_id, at_front=at_front,
+                                                   depends_on=Dependency(jobs=[preview_job_id], allow_failure=True)))
+    return queue.enqueue(finalize_video, video_id, source, depends_on=finalize_dependencies, at_front=at_front)
+
+
+
+def preview_settled(video_id):
+    """Runs once the preview job finished or failed, finalize_video waits for this step instead of the preview"""
+    return video_id
+
+
+
+def enqueue_rendition_job(queue, video_id, renditions, func, /, *args, **kwargs):
+    """
+    Records the renditions of the job as pending with its job id before it is enqueued,
+    so a worker never picks up a job whose VideoRendition rows do not exist yet.
+    """
+    job_id = str(uuid.uuid4())
+    for _, label in renditions:
+        VideoRendition.objects.update_or_create(video_id=video_id, label=label, defaults={
+            'status': VideoRendition.PENDING, 'job_id': job_id, 'error': '',
+        })
+    return queue.enqueue(func, *args, job_id=job_id, **kwargs)
+
+
+
+@contextmanager
+def track_renditions(video_id, targets):
+    """
+    Marks the renditions of targets (label => output file) as running, afterwards as done
+    with size, checksum and format of the output file or as failed with the ffmpeg error.
+    A done output is renamed to a name with its checksum, which is stored as the path of the rendition.
+    """
+    if video_id is None:
+        yield
+        return
+
+    renditions = VideoRendition.objects.filter(video_id=video_id, label__in=list(targets))
+    renditions.update(status=VideoRendition.RUNNING, error='', updated_at=timezone.now())
+    try:
+        yield
+        for target in targets.values():
+            verify_faststart(target)
+    except Exception as error:
+        message = '\n'.join(filter(None, [str(error), getattr(error, 'stderr', None)]))
+        renditions.update(status=VideoRendition.FAILED, error=message, updated_at=timezone.now())
+        raise
+    duration = Video.objects.filter(pk=video_id).values_list('duration', flat=True).first()
+    for label, target in targets.items():
+        checksum = output_checksum(target)
+        published = versioned_name(target, checksum)
+        os.replace(target, published)
+        size = os.path.getsize(published)
+        width, height = RENDITION_LABEL_SIZES[label]
+        VideoRendition.objects.update_or_create(video_id=video_id, label=label, defaults={
+            'status': VideoRendition.DONE, 'size': size, 'checksum': checksum,
+            'path': os.path.relpath(published, settings.MEDIA_ROOT), 'error': '',
+            'codec': RENDITION_CODEC, 'width': width, 'height': height,
+            'bitrate': int(size * 8 / duration.total_seconds()) if duration else None,
+        })
+
+
+
+def verify_faststart(path):
+    """
+    Raises ValueError unless the moov atom of the MP4 comes before its mdat atom,
+    otherwise browsers have to fetch the end of the file before playback can start.
+    """
+    with open(path, 'rb') as file:
+        while True:
+            header = file.read(8)
+            if len(header) < 8:
+                break
+            size, box_type = struct.unpack('>I4s', header)
+            if box_type == b'moov':
+                return
+            if box_type == b'mdat':
+                raise ValueError(f"The moov atom of {path} is behind mdat, the file is not fast start")
+            if size == 1:
+                size = struct.unpack('>Q', file.read(8))[0] - 8
+            elif size == 0:
+                break
+            file.seek(size - 8, os.SEEK_CUR)
+    raise ValueError(f"{path} has no moov atom")
+
+
+
+def output_checksum(path):
+    with open(path, 'rb') as file:
+        return file_sha256(File(file))
+
+
+
+def audio_path(source):
+    return sibling_name(source, '_audio.m4a')
+
+
+
+def encode_audio(source):
+    """
+    Encodes the audio of the upload once to AAC, every rendition muxes this track instead of encoding its own.
+    The file is written under a temporary name, so an existing one is always complete and is reused.
+    """
+    target = audio_path(source)
+    if os.path.isfile(target):
+        return target
+    partial = target.replace('.m4a', '.tmp.m4a')
+    run_ffmpeg(['ffmpeg', '-y', '-i', source, '-map', '0:a:0', '-vn', '-c:a', 'aac', '-strict', '-2', partial])
+    os.replace(partial, target)
+    return target
+
+
+
+def keyframe_expression():
+    """
+    Forces a keyframe at every HLS segment boundary, so all renditions can be segmented at the same timestamps.
+    """
+    return f'expr:gte(t,n_forced*{settings.HLS_SEGMENT_SECONDS})'
+
+
+
+def convert_video(source, resolution, label, video_id=None, duration_seconds=None, trickplay=False, audio=None):
     """
     Converts the video to the specified resolution and saves it with the specified label like => 480p, 720p and 1080p.
+    With a video_id the progress is stored for the status API, with trickplay the same decode also writes the sprites.
+    With audio (from encode_audio) that track is copied into the rendition instead of encoding the audio again.
     """
-    target = source.replace('.mp4', f'_{label}.mp4')
-    cmd = 'ffmpeg -i "{}" -s {} -c:v libx264 -crf 23 -c:a aac -strict -2 "{}"'.format(source, resolution, target)
-    subprocess.run(cmd, shell=True)
+    target = sibling_name(source, f'_{label}.mp4')
+    cmd = ['ffmpeg', '-i', source]
+    if audio:
+        cmd += ['-i', audio]
+    if trickplay:
+        cmd += ['-filter_complex', trickplay_filter(source, '[0:v]')]
+    if trickplay or audio:
+        cmd += ['-map', '0:v', '-map', '1:a' if audio else '0:a?']
+    cmd += ['-s', resolution, '-c:v', 'libx264', '-crf', '23', '-threads', encoder_threads(),
+            '-force_key_frames', keyframe_expression()]
+    cmd += ['-c:a', 'copy'] if audio else ['-c:a', 'aac', '-strict', '-2']
+    cmd += ['-movflags', '+faststart', target]
+    if trickplay:
+        cmd += trickplay_output(source)
+    with track_renditions(video_id, {label: target}):
+        with track_progress(video_id, [label], duration_seconds) as progress:
+            run_ffmpeg(cmd, progress)
+    if trickplay:
+        finish_trickplay(source, video_id, duration_seconds)
     return target
 
 
 
+def convert_video_single_pass(source, renditions, video_id=None, duration_seconds=None, has_audio=True):
+    """
+    Decodes the source only once and writes all renditions from one ffmpeg call with a split filter graph.
+    renditions is a list of (resolution, label) pairs like => [('hd480', '480p'), ('hd720', '720p')].
+    Returns a dict with the target file for every label.
+    """
+    targets = {label: sibling_name(source, f'_{label}.mp4') for _, label in renditions}
+    with track_renditions(video_id, targets):
+        audio = encode_audio(source) if has_audio else None
+        with track_progress(video_id, targets, duration_seconds) as progress:
+            run_ffmpeg(single_pass_command(source, renditions, targets, audio=audio, trickplay=True), progress)
+    finish_trickplay(source, video_id, duration_seconds)
+    return targets
+
+
+
+def single_pass_command(source, renditions, targets, audio=None, trickplay=False, faststart=True, thumbnails=None):
+    """
+    Builds the ffmpeg call that splits the decoded source into one scaled output per rendition.
+    With an audio file its track is copied into every output, without the outputs are video only.
+    With trickplay the split also feeds the sprite sheets, with thumbnails (an image pattern like thumb_%05d.jpg)
+    it writes the single thumbnails that tile_chunk_thumbnails puts together.
+    """
+    branches = len(renditions) + (1 if trickplay else 0) + (1 if thumbnails else 0)
+    outputs = ''.join(f'[v{index}]' for index in range(branches))
+    filters = [f'[0:v]split={branches}{outputs}']
+    for index, (resolution, _) in enumerate(renditions):
+        filters.append(f'[v{index}]scale=s={resolution}[out{index}]')
+    if trickplay:
+        filters.append(trickplay_filter(source, f'[v{len(renditions)}]'))
+    if thumbnails:
+        filters.append(trickplay_thumbnails(f'[v{branches - 1}]') + '[thumbnails]')
+
+    cmd = ['ffmpeg', '-i', source]
+    if audio:
+        cmd += ['-i', audio]
+    cmd += ['-filter_complex', ';'.join(filters)]
+    for index, (_, label) in enumerate(renditions):
+        cmd += ['-map', f'[out{index}]']
+        cmd += ['-map', '1:a', '-c:a', 'copy'] if audio else ['-an']
+        cmd += ['-c:v', 'libx264', '-crf', '23', '-threads', encoder_threads(len(renditions)),
+                '-force_key_frames', keyframe_expression()]
+        if faststart:
+            cmd += ['-movflags', '+faststart']
+        cmd += [targets[label]]
+    if trickplay:
+        cmd += trickplay_output(source)
+    if thumbnails:
+        cmd += ['-map', '[thumbnails]', '-q:v', '5', thumbnails]
+    return cmd
+
+
+
+def trickplay_thumbnails(input_label):
+    """Filter chain that picks one frame every TRICKPLAY_INTERVAL seconds and fits it into a thumbnail"""
+    width, height = settings.TRICKPLAY_THUMBNAIL_SIZE
+    return (f'{input_label}fps=1/{settings.TRICKPLAY_INTERVAL},'
+            f'scale={width}:{height}:force_original_aspect_ratio=decrease,'
+            f'pad={width}:{height}:(ow-iw)/2:(oh-ih)/2')
+
+
+
+def trickplay_filter(source, input_label):
+    """
+    Filter graph branch that turns the decoded frames into sprite sheets, one thumbnail every TRICKPLAY_INTERVAL seconds.
+    """
+    os.makedirs(sibling_name(source, '_trickplay'), exist_ok=True)
+    columns, rows = settings.TRICKPLAY_GRID
+    return f'{trickplay_thumbnails(input_label)},tile={columns}x{rows}[sprites]'
+
+
+
+def trickplay_output(source):
+    return ['-map', '[sprites]', '-q:v', '5', os.path.join(sibling_name(source, '_trickplay'), 'sprite_%03d.jpg')]
+
+
+
+def finish_trickplay(source, video_id, duration_seconds):
+    """
+    Writes the WebVTT index for the sprite sheets and stores the number of sheets on the video.
+    """
+    trickplay_dir = sibling_name(source, '_trickplay')
+    sheets = len(glob.glob(os.path.join(trickplay_dir, 'sprite_*.jpg')))
+    with open(os.path.join(trickplay_dir, 'thumbnails.vtt'), 'w') as vtt:
+        vtt.write(build_trickplay_vtt(sheets, duration_seconds))
+    if video_id is not None:
+        Video.objects.filter(pk=video_id).update(trickplay_sheets=sheets)
+        video_changed.send(sender=Video, video_id=video_id)
+    return sheets
+
+
+
+def build_trickplay_vtt(sheets, duration_seconds=None):
+    """
+    Builds the WebVTT track that maps every TRICKPLAY_INTERVAL seconds to its tile => sprite_001.jpg#xywh=x,y,w,h
+    """
+    interval = settings.TRICKPLAY_INTERVAL
+    width, height = settings.TRICKPLAY_THUMBNAIL_SIZE
+    columns, rows = settings.TRICKPLAY_GRID
+    thumbnails = sheets * columns * rows
+    if duration_seconds:
+        thumbnails = min(thumbnails, math.ceil(duration_seconds / interval))
+
+    def timestamp(seconds):
+        return f'{int(seconds // 3600):02d}:{int(seconds % 3600 // 60):02d}:{seconds % 60:06.3f}'
+
+    lines = ['WEBVTT', '']
+    for index in range(thumbnails):
+        start = index * interval
+        end = min(start + interval, duration_seconds) if duration_seconds else start + interval
+        sheet, position = divmod(index, columns * rows)
+        row, column = divmod(position, columns)
+        lines.append(f'{timestamp(start)} --> {timestamp(end)}')
+        lines.append(f'sprite_{sheet + 1:03d}.jpg#xywh={column * width},{row * height},{width},{height}')
+        lines.append('')
+    return '\n'.join(lines)
+
+
+
+def convert_video_chunked(source, renditions, duration_seconds, has_audio=True, video_id=None):
+    """
+    Transcodes long videos in parallel. The source is split at keyframes into VIDEO_CHUNK_WORKERS segments
+    without re-encoding, every segment is encoded to all renditions by its own ffmpeg process and the
+    encoded segments are concatenated losslessly. The audio is encoded once for the whole source,
+    so there are no gaps at the segment boundaries.
+    The decode of every segment also writes its trickplay thumbnails, the video is decoded only once.
+    Returns a dict with the target file for every label.
+    """
+    workers = settings.VIDEO_CHUNK_WORKERS
+    chunk_dir = sibling_name(source, '_chunks')
+    targets = {label: sibling_name(source, f'_{label}.mp4') for _, label in renditions}
+    segment_list = os.path.join(chunk_dir, 'chunks.csv')
+    os.makedirs(chunk_dir, exist_ok=True)
+    try:
+        with track_renditions(video_id, targets):
+            segment_time = max(1, math.ceil(duration_seconds / workers))
+            run_ffmpeg(['ffmpeg', '-i', source, '-map', '0:v:0', '-c', 'copy', '-f', 'segment',
+                        '-segment_time', str(segment_time), '-reset_timestamps', '1',
+                        '-segment_list', segment_list, '-segment_list_type', 'csv',
+                        os.path.join(chunk_dir, 'chunk_%05d.mkv')])
+            chunks = sorted(glob.glob(os.path.join(chunk_dir, 'chunk_*.mkv')))
+
+            # audio only, -vn keeps ffmpeg from decoding the video
+            audio = os.path.join(chunk_dir, 'audio.m4a') if has_audio else None
+            if audio:
+                run_ffmpeg(['ffmpeg', '-i', source, '-map', '0:a:0', '-vn', '-c:a', 'aac', '-strict', '-2', audio])
+
+            with track_progress(video_id, [label for _, label in renditions], duration_seconds) as progress:
+                def encode_chunk(part, chunk):
+                    chunk_targets = {label: chunk.replace('.mkv', f'_{label}.mp4') for _, label in renditions}
+                    run_ffmpeg(single_pass_command(chunk, renditions, chunk_targets, faststart=False,
+                                                   thumbnails=chunk.replace('.mkv', '_thumb_%05d.jpg')),
+                               progress, part)
+                    return chunk_targets
+
+                # every chunk is its own ffmpeg process, the threads only wait for them
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    encoded_chunks = list(pool.map(encode_chunk, range(len(chunks)), chunks))
+
+            tile_chunk_thumbnails(source, segment_list, duration_seconds)
+            finish_trickplay(source, video_id, duration_seconds)
+
+            for _, label in renditions:
+                concat_list = os.path.join(chunk_dir, f'{label}.txt')
+                with open(concat_list, 'w') as file:
+                    for chunk_targets in encoded_chunks:
+                        escaped_path = chunk_targets[label].replace("'", "'\\''")
+                        file.write(f"file '{escaped_path}'\n")
+
+                cmd = ['ffmpeg', '-f', 'concat', '-safe', '0', '-i', concat_list]
+                cmd += ['-i', audio, '-map', '0:v', '-map', '1:a'] if audio else []
+                cmd += ['-c', 'copy', '-movflags', '+faststart', targets[label]]
+                run_ffmpeg(cmd)
+        return targets
+    finally:
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+
+
+
+def tile_chunk_thumbnails(source, segment_list, duration_seconds):
+    """
+    Puts the thumbnails of the chunk encodes together into the sprite sheets. A chunk starts at a keyframe,
+    not at a multiple of TRICKPLAY_INTERVAL, so every slot of the WebVTT track gets the thumbnail nearest to it.
+    Tiling the small JPEGs is one cheap ffmpeg call, the source is not read again.
+    """
+    interval = settings.TRICKPLAY_INTERVAL
+    chunk_dir = os.path.dirname(segment_list)
+    thumbnails = []
+    with open(segment_list, newline='') as file:
+        for name, start, *_ in csv.reader(file):
+            pattern = glob.escape(os.path.join(chunk_dir, os.path.basename(name).replace('.mkv', '_thumb_'))) + '*.jpg'
+            thumbnails += [(float(start) + index * interval, path)
+                           for index, path in enumerate(sorted(glob.glob(pattern)))]
+    if not thumbnails:
+        return
+    thumbnails.sort()
+    seconds = [second for second, _ in thumbnails]
+
+    frame_dir = os.path.join(chunk_dir, 'trickplay')
+    os.makedirs(frame_dir, exist_ok=True)
+    slots = math.ceil(duration_seconds / interval) if duration_seconds else len(thumbnails)
+    for slot in range(slots):
+        position = bisect.bisect_left(seconds, slot * interval)
+        nearest = min([index for index in (position - 1, position) if 0 <= index < len(thumbnails)],
+                      key=lambda index: abs(seconds[index] - slot * interval))
+        shutil.copy(thumbnails[nearest][1], os.path.join(frame_dir, f'frame_{slot + 1:05d}.jpg'))
+
+    trickplay_dir = sibling_name(source, '_trickplay')
+    os.makedirs(trickplay_dir, exist_ok=True)
+    columns, rows = settings.TRICKPLAY_GRID
+    run_ffmpeg(['ffmpeg', '-framerate', '1', '-i', os.path.join(frame_dir, 'frame_%05d.jpg'),
+                '-vf', f'tile={columns}x{rows}', '-q:v', '5', os.path.join(trickplay_dir, 'sprite_%03d.jpg')])
+
+
+
+def package_hls(source, renditions, video_id=None):
+    """
+    Remuxes the finished renditions into HLS segments (no re-encode) and writes a master playlist for them.
+    The output lands in <base>_hls/ => master.m3u8 and one folder with index.m3u8 and segments per label.
+    """
+    hls_dir = sibling_name(source, '_hls')
+    rendition_files = rendition_paths(video_id, source, renditions)
+    variants = []
+    for resolution, label in renditions:
+        variant_dir = os.path.join(hls_dir, label)
+        os.makedirs(variant_dir, exist_ok=True)
+        playlist = os.path.join(variant_dir, 'index.m3u8')
+        cmd = ['ffmpeg', '-y', '-i', rendition_files[label], '-c', 'copy',
+               '-f', 'hls', '-hls_time', str(settings.HLS_SEGMENT_SECONDS), '-hls_playlist_type', 'vod',
+               '-hls_segment_filename', os.path.join(variant_dir, 'segment_%05d.ts'), playlist]
+        run_ffmpeg(cmd)
+        variants.append((resolution, label, playlist))
+
+    master_playlist = os.path.join(hls_dir, 'master.m3u8')
+    with open(master_playlist, 'w') as master:
+        master.write(build_master_playlist(variants))
+    return master_playlist
+
+
+
+def rendition_paths(video_id, source, renditions):
+    """
+    Returns label => file of the renditions, the versioned path of a done rendition
+    or the name the encoders write to.
+    """
+    paths = {label: sibling_name(source, f'_{label}.mp4') for _, label in renditions}
+    if video_id is not None:
+        done = VideoRendition.objects.filter(video_id=video_id, status=VideoRendition.DONE).exclude(path='')
+        for label, path in done.values_list('label', 'path'):
+            if label in paths:
+                paths[label] = os.path.join(settings.MEDIA_ROOT, path)
+    return paths
+
+
+
+def build_master_playlist(variants):
+    """
+    Builds the master playlist for (resolution, label, variant playlist) entries, lowest bitrate first.
+    """
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3']
+    for resolution, label, playlist in variants:
+        peak, average = hls_variant_bandwidth(playlist)
+        width, height = RENDITION_SIZES[resolution]
+        lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={peak},AVERAGE-BANDWIDTH={average},RESOLUTION={width}x{height}')
+        lines.append(f'{label}/index.m3u8')
+    return '\n'.join(lines) + '\n'
+
+
+
+def hls_variant_bandwidth(playlist):
+    """
+    Returns the (peak, average) bits per second of a variant playlist, measured on its segment files.
+    """
+    variant_dir = os.path.dirname(playlist)
+    peak = total_bits = total_duration = 0
+    duration = None
+    with open(playlist) as lines:
+        for line in lines:
+            line = line.strip()
+            if line.startswith('#EXTINF:'):
+                duration = float(line[len('#EXTINF:'):].split(',')[0])
+            elif line and not line.startswith('#') and duration:
+                bits = os.path.getsize(os.path.join(variant_dir, line)) * 8
+                peak = max(peak, bits / duration)
+                total_bits += bits
+                total_duration += duration
+                duration = None
+    average = total_bits / total_duration if total_duration else 0
+    return int(peak), int(average)
+
+
+
 def delete_original_file(file_path):
     print(f"Attempting to delete file: {file_path}")
     if os.path.isfile(file_path):
@@ -31,6 +739,101 @@ def delete_original_file(file_path):
 
 
 
+def finalize_video(video_id, file_path):
+    """
+    Fan-in step of the transcode jobs, RQ only runs it after every rendition job succeeded.
+    Deletes the original upload and the shared audio track and marks the video as ready.
+    """
+    delete_original_file(file_path)
+    if os.path.isfile(audio_path(file_path)):
+        os.remove(audio_path(file_path))
+    Video.objects.filter(pk=video_id).update(is_ready=True)
+    video_changed.send(sender=Video, video_id=video_id)
+
+
+
+class ReconcileAttemptsExhausted(Exception):
+    """The jobs of a video were re-enqueued TRANSCODE_MAX_ATTEMPTS times and still did not make it ready"""
+
+
+
+def reconcile_video(video, stale_after=None):
+    """
+    Re-enqueues what crashed workers left undone for a video that is not ready yet. Renditions that are done
+    and still intact on disk are kept, only the missing and failed ones are encoded again.
+    Returns the enqueued steps like => ['720p', '1080p'], ['analyze'] or ['package'].
+    Raises ReconcileAttemptsExhausted instead of enqueueing a video that keeps failing again and again.
+    """
+    if video.is_ready:
+        return []
+    source = video.video_file.path
+    if not os.path.isfile(source):
+        print(f"Uploadfile of video {video.id} not found, cannot reconcile: {source}")
+        return []
+
+    stale_after = timedelta(seconds=settings.TRANSCODE_STALE_AFTER) if stale_after is None else stale_after
+    stale_before = timezone.now() - stale_after
+    renditions = {rendition.label: rendition for rendition in video.renditions.all()}
+
+    if not renditions:
+        # analyze_video never got to enqueue the renditions
+        if video.uploaded_at > stale_before:
+            return []
+        count_reconcile_attempt(video)
+        preview_job_id = None
+        if not video.preview_ready:
+            preview_job_id = django_rq.get_queue('preview').enqueue(encode_preview, video.id, source).id
+        django_rq.get_queue('backfill').enqueue(analyze_video, video.id, source, preview_job_id=preview_job_id,
+                                                queue_name='backfill')
+        return ['analyze']
+
+    if any(rendition.status in (VideoRendition.PENDING, VideoRendition.RUNNING) and job_alive(rendition.job_id)
+           for rendition in renditions.values()):
+        return []
+
+    ladder = video.rendition_ladder
+    missing = [label for _, label in ladder if not rendition_intact(renditions.get(label))]
+    if not missing and max(rendition.updated_at for rendition in renditions.values()) > stale_before:
+        # package_hls and finalize_video may still be waiting in the queue
+        return []
+
+    count_reconcile_attempt(video)
+    duration_seconds = video.duration.total_seconds() if video.duration else None
+    enqueue_transcode_jobs(video.id, source, ladder, duration_seconds=duration_seconds,
+                           has_audio=bool(video.audio_codec), labels=missing, queue_name='backfill')
+    return missing or ['package']
+
+
+
+def count_reconcile_attempt(video):
+    if video.reconcile_attempts >= settings.TRANSCODE_MAX_ATTEMPTS:
+        raise ReconcileAttemptsExhausted(f'Video {video.id} was re-enqueued {video.reconcile_attempts} times')
+    Video.objects.filter(pk=video.pk).update(reconcile_attempts=F('reconcile_attempts') + 1)
+    video.reconcile_attempts += 1
+
+
+
+def job_alive(job_id):
+    """True while the RQ job is queued, deferred or running"""
+    if not job_id:
+        return False
+    try:
+        job = Job.fetch(job_id, connection=django_rq.get_connection('transcode'))
+    except NoSuchJobError:
+        return False
+    return job.get_status() in (JobStatus.QUEUED, JobStatus.DEFERRED, JobStatus.SCHEDULED, JobStatus.STARTED)
+
+
+
+def rendition_intact(rendition):
+    """True for a done rendition whose output file still has the recorded size"""
+    if rendition is None or rendition.status != VideoRendition.DONE or not rendition.path:
+        return False
+    target = os.path.join(settings.MEDIA_ROOT, rendition.path)
+    return os.path.isfile(target) and os.path.getsize(target) == rendition.size
+
+
+
 def send_activation_email(user, request):
     token = default_token_generator.make_token(user)
     uid = urlsafe_base64_encode(force_bytes(user.pk))
@@ -52,4 +855,10 @@ def send_activation_email(user, request):
         to=recipient_list
     )
     email.attach_alternative(html_message, "text/html")
+    django_rq.get_queue('email').enqueue(send_email, email)
+
+
+
+def send_email(email):
+    """Sends a prepared EmailMessage on the email queue, so the request does not wait for the mail server"""
     email.send()
\ No newline at end of file
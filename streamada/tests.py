@@ -9,7 +9,7 @@ from django.utils.http import urlsafe_base64_encode
 from django.utils.encoding import force_bytes
 from django.contrib.auth.tokens import default_token_generator
 from rest_framework.authtoken.models import Token
-from rest_framework.test import APIClient
+from rest_framework.test import APIClient, APIRequestFactory
 from django.contrib.auth import get_user_model
 from django.contrib.auth.tokens import PasswordResetTokenGenerator
 from streamada.models import Video
@@ -20,13 +20,73 @@ from unittest import mock
 from streamada.tasks import delete_original_file
 import os
 import subprocess
-from streamada.tasks import convert_video
-from streamada.signals import auto_delete_file_on_delete
+from streamada.tasks import convert_video, convert_video_single_pass, finalize_video, package_hls, build_master_playlist
+from streamada.tasks import build_trickplay_vtt
+from streamada.tasks import encode_preview, analyze_video, enqueue_transcode_jobs, probe_video, convert_video_chunked, run_ffmpeg
+from streamada.progress import TranscodeProgress, progress_key
+from streamada.uploadhandlers import HashingTemporaryFileUploadHandler
+import hashlib
+import base64
+from streamada.models import VideoUpload
+import io
+from streamada.models import select_renditions, thumbnail_upload_to
+from datetime import timedelta
+from django.utils import timezone
+import json
+import tempfile
+from django.test import override_settings
+from django.conf import settings
+from streamada.models import MediaTombstone
+from streamada.storage import purge_media_tombstones, find_orphaned_media
+from streamada.models import VideoRendition
+from streamada.tasks import ReconcileAttemptsExhausted, reconcile_video, rendition_intact
+from streamada.feed import refresh_feed, build_feed_row
+from streamada.cache import video_cache_version, bump_video_cache_version, VIDEO_CACHE_VERSION_KEY
+from streamada.cache import api_cache_key, cached_api_data, refresh_api_cache, refresh_due, store_api_data
+from streamada.views import build_video_detail
+from streamada.fragments import store_video_fragment, render_videos, fragment_rows, FRAGMENT_COLUMNS
+from rest_framework.renderers import JSONRenderer
+from streamada.search import search_videos
+from streamada.models import video_changed
+from django.core.management import call_command
+from streamada.tasks import ffmpeg_slot, single_pass_command, send_email
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from streamada.tasks import encode_audio, verify_faststart, preview_settled, hash_upload
+from rq.job import Job, JobStatus
+import struct
+from streamada.streaming import RangeFile
+from streamada.signed_media import sign_media_url, verify_media_token
+import time
+from streamada.management.commands import benchmark_transcode
 
 
 
 User = get_user_model()
 
+
+
+class TemporaryMediaMixin:
+    """Runs every test with MEDIA_ROOT in a temporary directory and the RQ queues mocked"""
+
+    def media_settings(self):
+        """Settings overridden next to MEDIA_ROOT, self.media_root is already set"""
+        return {}
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.media_root = media_root.name
+        media_override = override_settings(MEDIA_ROOT=self.media_root, **self.media_settings())
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+        queue_patch = mock.patch('django_rq.get_queue')
+        self.mock_get_queue = queue_patch.start()
+        self.queue = self.mock_get_queue.return_value
+        self.addCleanup(queue_patch.stop)
+
 class CacheTestCase(TestCase):
     """Test if Redis works well with Django"""
     
@@ -53,7 +113,8 @@ class CacheTestCase(TestCase):
 
 
 class RegisterUserTest(APITestCase):
-    def test_register_user_success(self):
+    @mock.patch('streamada.tasks.django_rq.get_queue')
+    def test_register_user_success(self, mock_get_queue):
         url = reverse('register_user')
         data = {
             'first_name': 'Test',
@@ -68,6 +129,10 @@ class RegisterUserTest(APITestCase):
         self.assertEqual(User.objects.count(), 1)
         user = User.objects.get(email='testuser@example.com')
         self.assertFalse(user.is_active)
+        mock_get_queue.assert_called_once_with('email')
+        func, email = mock_get_queue.return_value.enqueue.call_args.args
+        self.assertEqual(func, send_email)
+        self.assertEqual(email.to, ['testuser@example.com'])
 
 
 
@@ -232,8 +297,8 @@ def test_video_list(self):
 
     print("Response JSON:", response.json())
 
-    response_data = response.json()
-    self.assertIsInstance(response_data, list, "Expected a list in response.json()")
+    response_data = response.json()['results']
+    self.assertIsInstance(response_data, list, "Expected a list in response.json()['results']")
 
     for response_video, expected_video in zip(response_data, serializer.data):
         self.assertEqual(response_video['title'], expected_video['title'])
@@ -242,6 +307,319 @@ def test_video_list(self):
 
 
 
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class VideoListPaginationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='viewer', password='testpass123'))
+        self.url = reverse('video-list')
+
+        with mock.patch('streamada.signals.django_rq.get_queue'):
+            self.videos = [
+                Video.objects.create(title=f"Video {index}", genre="Sport" if index % 2 else "Crime",
+                                     add_to_new_video_feed=(index < 2), video_file=f"videos/video_{index}.mp4")
+                for index in range(5)
+            ]
+        # two videos share a timestamp, the id keeps their order stable
+        now = timezone.now()
+        for index, video in enumerate(self.videos):
+            Video.objects.filter(pk=video.pk).update(uploaded_at=now - timedelta(minutes=min(index, 3)))
+
+    def collect(self, url):
+        ids = []
+        while url:
+            with self.assertNumQueries(1):
+                data = self.client.get(url).json()
+            ids += [video['id'] for video in data['results']]
+            url = data['next']
+        return ids
+
+    def test_pages_follow_the_cursor_newest_first(self):
+        ids = self.collect(f'{self.url}?page_size=2')
+
+        newest_first = [video.id for video in self.videos[:3]] + [self.videos[4].id, self.videos[3].id]
+        self.assertEqual(ids, newest_first)
+
+    def test_filters(self):
+        self.assertEqual(self.collect(f'{self.url}?genre=Sport'), [self.videos[1].id, self.videos[3].id])
+        self.assertEqual(self.collect(f'{self.url}?add_to_new_video_feed=true&genre=Crime'), [self.videos[0].id])
+
+        self.assertEqual(self.client.get(f'{self.url}?genre=Opera').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(f'{self.url}?add_to_new_video_feed=maybe').status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}, FEED_ROW_SIZE=2)
+class VideoFeedTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='viewer', password='testpass123'))
+        self.url = reverse('video-feed')
+
+        queue_patch = mock.patch('streamada.signals.django_rq.get_queue')
+        queue_patch.start()
+        self.addCleanup(queue_patch.stop)
+        self.sport = [Video.objects.create(title=f"Sport {index}", genre="Sport", video_file=f"videos/sport_{index}.mp4",
+                                           add_to_new_video_feed=(index == 0)) for index in range(3)]
+        self.crime = Video.objects.create(title="Crime", genre="Crime", video_file="videos/crime.mp4")
+
+    def rows(self):
+        data = self.client.get(self.url).json()
+        rows = {row['genre']: [video['id'] for video in row['videos']] for row in data['genres']}
+        rows['new_video_feed'] = [video['id'] for video in data['new_video_feed']]
+        return rows
+
+    def test_feed_is_served_from_the_cache(self):
+        rows = self.rows()
+
+        self.assertEqual(rows['Sport'], [self.sport[2].id, self.sport[1].id])
+        self.assertEqual(rows['Crime'], [self.crime.id])
+        self.assertEqual(rows['new_video_feed'], [self.sport[0].id])
+        self.assertEqual(rows['Western'], [])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.rows(), rows)
+
+    def test_media_urls_are_signed_per_response(self):
+        Video.objects.filter(pk=self.crime.pk).update(preview_ready=True)
+        video_changed.send(sender=Video, video_id=self.crime.id)
+        refresh_feed(self.crime.id)
+
+        self.assertEqual(cache.get('video-feed:Crime')[0][2]['preview_url'], '/media/videos/crime_preview.mp4')
+        data = self.client.get(self.url).json()
+        crime = next(row for row in data['genres'] if row['genre'] == 'Crime')['videos'][0]
+        self.assertTrue(crime['preview_url'].startswith('http://testserver/api/media/'))
+
+    def test_changes_rebuild_only_the_affected_rows(self):
+        self.rows()
+
+        with mock.patch('streamada.feed.build_feed_row', wraps=build_feed_row) as mock_build, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.sport[2].genre = 'Crime'
+            self.sport[2].save()
+        self.assertEqual(sorted(call.args[0] for call in mock_build.call_args_list), ['Crime', 'Sport'])
+        rows = self.rows()
+        self.assertEqual(rows['Sport'], [self.sport[1].id, self.sport[0].id])
+        self.assertEqual(rows['Crime'], [self.crime.id, self.sport[2].id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sport[0].delete()
+        self.assertEqual(self.rows()['new_video_feed'], [])
+
+    @mock.patch('streamada.tasks.delete_original_file')
+    def test_transcode_jobs_refresh_the_feed(self, mock_delete):
+        self.rows()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            finalize_video(self.crime.id, self.crime.video_file.path)
+
+        data = self.client.get(self.url).json()
+        crime = next(row for row in data['genres'] if row['genre'] == 'Crime')['videos'][0]
+        self.assertTrue(crime['is_ready'])
+
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ApiResponseCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='viewer', password='testpass123'))
+
+        queue_patch = mock.patch('streamada.signals.django_rq.get_queue')
+        self.queue = queue_patch.start().return_value
+        self.addCleanup(queue_patch.stop)
+        self.video = Video.objects.create(title="Cached", genre="Crime", video_file="videos/cached.mp4",
+                                          preview_ready=True)
+        self.queue.reset_mock()
+        self.url = reverse('video-detail', kwargs={'id': self.video.id})
+
+    def test_detail_is_cached_until_the_video_changes(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            data = self.client.get(self.url).json()
+        self.assertEqual(data['title'], 'Cached')
+        self.assertTrue(data['preview_url'].startswith('http://testserver/api/media/'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.video.title = 'Edited'
+            self.video.save()
+
+        self.assertEqual(self.client.get(self.url).json()['title'], 'Edited')
+
+    def test_update_does_not_write_back_the_pipeline_fields(self):
+        stale = Video.objects.get(pk=self.video.pk)
+        # finalize_video marks the video ready while the request holds its copy of the row
+        Video.objects.filter(pk=self.video.pk).update(is_ready=True, height=720)
+
+        with mock.patch('streamada.views.VideoDetailAPIView.get_object', return_value=stale):
+            response = self.client.patch(self.url, {'title': 'Edited', 'is_ready': False}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        video = Video.objects.get(pk=self.video.pk)
+        self.assertEqual((video.title, video.is_ready, video.height), ('Edited', True, 720))
+
+    @mock.patch('streamada.tasks.delete_original_file')
+    def test_transcode_updates_invalidate_the_list(self, mock_delete):
+        list_url = reverse('video-list')
+        self.assertFalse(self.client.get(list_url).json()['results'][0]['is_ready'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            finalize_video(self.video.id, self.video.video_file.path)
+
+        self.assertTrue(self.client.get(list_url).json()['results'][0]['is_ready'])
+
+    def test_stale_response_is_served_while_one_job_refreshes_it(self):
+        list_url = reverse('video-list') + '?page_size=1&genre=Crime'
+        self.client.get(list_url)
+        key = api_cache_key(f'http://testserver{list_url}', 'streamada.views.build_video_list')
+        cache.set(key, {**cache.get(key), 'expires': time.time() - 1})
+        Video.objects.filter(pk=self.video.pk).update(title='Refreshed')
+        store_video_fragment(self.video.pk)
+
+        queue = self.queue
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(list_url).json()['results'][0]['title'], 'Cached')
+            self.assertEqual(self.client.get(list_url).json()['results'][0]['title'], 'Cached')
+        queue.enqueue.assert_called_once()
+        self.assertEqual(queue.enqueue.call_args.args[0], refresh_api_cache)
+
+        refresh_api_cache(*queue.enqueue.call_args.args[1:])
+
+        self.assertEqual(self.client.get(list_url).json()['results'][0]['title'], 'Refreshed')
+        self.assertIsNone(cache.get(queue.enqueue.call_args.args[2] + ':lock'))
+
+    def test_missing_response_is_built_once(self):
+        request = APIRequestFactory().get(self.url)
+        key = api_cache_key(request.build_absolute_uri(), 'streamada.views.build_video_detail')
+        cache.add(f'{key}:lock', True)
+
+        def other_request_finishes(seconds):
+            store_api_data(key, {'title': 'From the lock holder'}, 0.1)
+
+        with mock.patch('streamada.cache.time.sleep', side_effect=other_request_finishes), \
+                self.assertNumQueries(0):
+            data = cached_api_data(request, build_video_detail, id=self.video.id)
+        self.assertEqual(data, {'title': 'From the lock holder'})
+
+    def test_early_refresh_chance_grows_towards_expiry(self):
+        entry = {'data': {}, 'delta': 2, 'expires': time.time() + 10}
+
+        with mock.patch('streamada.cache.random.random', return_value=0.0):
+            self.assertFalse(refresh_due(entry))
+        with mock.patch('streamada.cache.random.random', return_value=0.999999):
+            self.assertTrue(refresh_due(entry))
+        self.assertTrue(refresh_due({**entry, 'expires': time.time() - 1}))
+
+    def test_lost_version_never_goes_back(self):
+        version = video_cache_version()
+        self.assertEqual(bump_video_cache_version(), version + 1)
+
+        cache.delete(VIDEO_CACHE_VERSION_KEY)
+        self.assertGreater(video_cache_version(), version + 1)
+
+
+
+class VideoFragmentTest(TestCase):
+    def setUp(self):
+        with mock.patch('streamada.signals.django_rq.get_queue'):
+            self.video = Video.objects.create(title="Fragment \u00e9", genre="Sport", video_file="videos/fragment.mp4",
+                                              thumbnail="thumbnails/poster.0123456789abcdef.jpg", height=720,
+                                              duration=timedelta(seconds=90))
+        VideoRendition.objects.create(video=self.video, label='720p', status=VideoRendition.DONE,
+                                      path='videos/fragment_720p.0123456789abcdef.mp4')
+        Video.objects.filter(pk=self.video.pk).update(is_ready=True, trickplay_sheets=2)
+        video_changed.send(sender=Video, video_id=self.video.pk)
+
+    def test_spliced_fragment_matches_the_serializer(self):
+        request = APIRequestFactory().get('/api/videos/')
+        video = Video.objects.prefetch_related('renditions').get(pk=self.video.pk)
+        expected = json.loads(JSONRenderer().render(VideoSerializer(video, context={'request': request}).data))
+
+        rows = fragment_rows(Video.objects.filter(pk=video.pk).values(*FRAGMENT_COLUMNS))
+
+        self.assertEqual(json.loads(render_videos(rows, request)), [expected])
+        self.assertIn('/api/media/', expected['video_720p_url'])
+
+    def test_videos_without_fragment_get_one(self):
+        Video.objects.filter(pk=self.video.pk).update(api_fragment='', media_urls={})
+
+        with self.assertNumQueries(4):
+            rows = fragment_rows(Video.objects.filter(pk=self.video.pk).values(*FRAGMENT_COLUMNS))
+        self.assertEqual(json.loads(rows[0][1])['title'], "Fragment \u00e9")
+        self.assertTrue(Video.objects.get(pk=self.video.pk).api_fragment)
+
+    def test_only_done_renditions_are_advertised(self):
+        VideoRendition.objects.filter(video=self.video).update(codec='h264', width=1280, height=720, bitrate=2500000,
+                                                               size=1024)
+        VideoRendition.objects.create(video=self.video, label='480p', status=VideoRendition.FAILED,
+                                      path='videos/fragment_480p.mp4')
+        store_video_fragment(self.video.pk)
+
+        rows = fragment_rows(Video.objects.filter(pk=self.video.pk).values(*FRAGMENT_COLUMNS))
+        data = json.loads(render_videos(rows, APIRequestFactory().get('/api/videos/')))[0]
+
+        self.assertEqual(data['video_480p_url'], '')
+        [rendition] = data['renditions']
+        self.assertEqual({key: rendition[key] for key in ['label', 'codec', 'width', 'height', 'bitrate', 'size']},
+                         {'label': '720p', 'codec': 'h264', 'width': 1280, 'height': 720, 'bitrate': 2500000,
+                          'size': 1024})
+        self.assertEqual(rendition['url'], data['video_720p_url'])
+        self.assertIn('/api/media/', rendition['url'])
+
+
+
+class VideoSearchTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='viewer', password='testpass123'))
+        with mock.patch('streamada.signals.django_rq.get_queue'):
+            self.story = Video.objects.create(title="Crime Story", description="A detective in the city",
+                                              genre="Crime", video_file="videos/story.mp4")
+            self.match = Video.objects.create(title="Final Match", description="The crime of the century",
+                                              genre="Sport", video_file="videos/match.mp4")
+            self.cafe = Video.objects.create(title="Caf\u00e9 Racer", description="Motorbikes",
+                                             genre="Sport", video_file="videos/cafe.mp4")
+
+    def test_title_matches_rank_first(self):
+        self.assertEqual(search_videos('crime'), [self.story.id, self.match.id])
+
+    def test_prefix_and_genre(self):
+        self.assertEqual(search_videos('cri sto'), [self.story.id])
+        self.assertEqual(search_videos('cafe'), [self.cafe.id])
+        self.assertEqual(search_videos('crime', genre='Sport'), [self.match.id])
+        self.assertEqual(search_videos('?!'), [])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.story.title = "Heist"
+        self.story.save()
+        self.match.delete()
+
+        self.assertEqual(search_videos('crime'), [])
+        self.assertEqual(search_videos('heist'), [self.story.id])
+
+    def test_video_without_description_is_indexed(self):
+        with mock.patch('streamada.signals.django_rq.get_queue'):
+            video = Video.objects.create(title="Silent Film", description=None, genre="Abstract",
+                                         video_file="videos/silent.mp4")
+
+        self.assertEqual(search_videos('silent'), [video.id])
+
+    def test_endpoint_returns_the_videos_in_rank_order(self):
+        response = self.client.get(reverse('video-search'), {'q': 'crim', 'limit': 1})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([video['id'] for video in response.json()['results']], [self.story.id])
+        self.assertEqual(response.json()['results'][0]['title'], "Crime Story")
+        self.assertEqual(self.client.get(reverse('video-search'), {'q': ''}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(reverse('video-search'), {'q': 'crime', 'genre': 'Opera'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+
+
 class DeleteOriginalFileTest(TestCase):
     @mock.patch('os.remove') 
     @mock.patch('os.path.isfile')
@@ -281,8 +659,8 @@ class DeleteOriginalFileTest(TestCase):
 
 
 class ConvertVideoTest(TestCase):
-    @mock.patch('subprocess.run') 
-    def test_convert_video(self, mock_subprocess):
+    @mock.patch('streamada.tasks.run_ffmpeg')
+    def test_convert_video(self, mock_run_ffmpeg):
         source = "/path/to/source/file.mp4"
         resolution = "1280x720"
         label = "720p"
@@ -291,33 +669,1017 @@ class ConvertVideoTest(TestCase):
 
         result = convert_video(source, resolution, label)
 
-        expected_cmd = f'ffmpeg -i "{source}" -s {resolution} -c:v libx264 -crf 23 -c:a aac -strict -2 "{expected_target}"'
-        mock_subprocess.assert_called_once_with(expected_cmd, shell=True)
+        expected_cmd = ['ffmpeg', '-i', source, '-s', resolution, '-c:v', 'libx264', '-crf', '23',
+                        '-threads', str(settings.FFMPEG_THREADS), '-force_key_frames', 'expr:gte(t,n_forced*6)', '-c:a', 'aac', '-strict', '-2',
+                        '-movflags', '+faststart', expected_target]
+        mock_run_ffmpeg.assert_called_once_with(expected_cmd, None)
 
         self.assertEqual(result, expected_target)
         print("Test: Convert video - passed")
 
+    @mock.patch('streamada.tasks.run_ffmpeg')
+    def test_outputs_of_uploads_that_are_no_mp4(self, mock_run_ffmpeg):
+        result = convert_video("/path/to/source/file.MOV", "1280x720", "720p")
+
+        self.assertEqual(result, "/path/to/source/file_720p.mp4")
+        self.assertEqual(mock_run_ffmpeg.call_args.args[0][-1], result)
+
+    @mock.patch('streamada.tasks.run_ffmpeg')
+    def test_convert_video_single_pass(self, mock_subprocess):
+        renditions = [('hd480', '480p'), ('hd720', '720p'), ('hd1080', '1080p')]
+        mock_subprocess.side_effect = lambda cmd, progress=None: open(cmd[-1], 'w').close() if cmd[-1].endswith('.m4a') else None
+
+        with tempfile.TemporaryDirectory() as folder:
+            source = os.path.join(folder, 'file.mp4')
+
+            result = convert_video_single_pass(source, renditions)
+
+            self.assertTrue(os.path.isfile(os.path.join(folder, 'file_trickplay', 'thumbnails.vtt')))
+            self.assertTrue(os.path.isfile(os.path.join(folder, 'file_audio.m4a')))
+
+        self.assertEqual(result, {label: os.path.join(folder, f'file_{label}.mp4') for _, label in renditions})
+        audio_cmd, cmd = [call.args[0] for call in mock_subprocess.call_args_list]
+        self.assertEqual(audio_cmd[audio_cmd.index('-c:a') + 1], 'aac')
+        self.assertEqual(cmd[:5], ['ffmpeg', '-i', source, '-i', os.path.join(folder, 'file_audio.m4a')])
+        self.assertEqual(cmd.count('-c:a'), 3)
+        self.assertEqual({cmd[index + 1] for index, arg in enumerate(cmd) if arg == '-c:a'}, {'copy'})
+        self.assertEqual(cmd.count('+faststart'), 3)
+        filter_graph = cmd[cmd.index('-filter_complex') + 1]
+        self.assertIn('[0:v]split=4[v0][v1][v2][v3]', filter_graph)
+        self.assertIn('[v3]fps=1/10', filter_graph)
+        self.assertTrue(cmd[-1].endswith(os.path.join('file_trickplay', 'sprite_%03d.jpg')))
+        for target in result.values():
+            self.assertIn(target, cmd)
+
+    def test_trickplay_vtt(self):
+        vtt = build_trickplay_vtt(sheets=2, duration_seconds=255)
+
+        lines = vtt.splitlines()
+        self.assertEqual(lines[0], 'WEBVTT')
+        self.assertEqual(lines[2:4], ['00:00:00.000 --> 00:00:10.000', 'sprite_001.jpg#xywh=0,0,160,90'])
+        self.assertEqual(lines[-2:], ['00:04:10.000 --> 00:04:15.000', 'sprite_002.jpg#xywh=0,0,160,90'])
+        self.assertIn('sprite_001.jpg#xywh=160,90,160,90', lines)
+
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class VideoPostSaveTest(TestCase):
+    @mock.patch('streamada.signals.django_rq.get_queue')
+    def test_upload_enqueues_preview_first(self, mock_get_queue):
+        queues = {'preview': mock.MagicMock(), 'transcode': mock.MagicMock()}
+        mock_get_queue.side_effect = queues.get
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            video = Video.objects.create(title="Upload", genre="Abstract", video_file="videos/upload.mp4",
+                                         content_hash='0' * 64)
+        # a worker never gets the job before the video is committed
+        mock_get_queue.assert_not_called()
+        for callback in callbacks:
+            callback()
+
+        path = video.video_file.path
+        queues['preview'].enqueue.assert_called_once_with(encode_preview, video.id, path, at_front=False)
+        preview_job = queues['preview'].enqueue.return_value
+        queues['transcode'].enqueue.assert_called_once_with(analyze_video, video.id, path,
+                                                            preview_job_id=preview_job.id, at_front=False)
+
+    @mock.patch('streamada.signals.django_rq.get_queue')
+    def test_upload_next_to_the_renditions_of_another_video(self, mock_get_queue):
+        Video.objects.create(title="First", genre="Abstract", video_file="videos/clip.mp4")
+
+        with self.assertRaises(ValueError):
+            Video.objects.create(title="Second", genre="Abstract", video_file="videos/clip.MOV")
+        Video.objects.create(title="Third", genre="Abstract", video_file="videos/clip.part.mp4")
+
+    @mock.patch('django_rq.get_queue')
+    def test_new_feed_videos_jump_the_line(self, mock_get_queue):
+        queue = mock_get_queue.return_value
+
+        with self.captureOnCommitCallbacks(execute=True):
+            video = Video.objects.create(title="Featured", genre="New", video_file="videos/featured.mp4",
+                                         add_to_new_video_feed=True, content_hash='0' * 64)
+        enqueue_transcode_jobs(video.id, video.video_file.path, [('hd480', '480p')], at_front=True)
+
+        for call in queue.enqueue.call_args_list:
+            self.assertTrue(call.kwargs['at_front'])
+        self.assertEqual({call.args[0] for call in mock_get_queue.call_args_list}, {'preview', 'transcode'})
+
+    @override_settings(FFMPEG_MAX_PROCESSES=1)
+    def test_ffmpeg_slots_limit_concurrent_processes(self):
+        with tempfile.TemporaryDirectory() as folder, override_settings(FFMPEG_SLOT_DIR=folder):
+            with ffmpeg_slot() as slot:
+                self.assertEqual(slot, 0)
+                def wait_for_slot():
+                    with ffmpeg_slot():
+                        pass
+                waiter = threading.Thread(target=wait_for_slot)
+                with mock.patch('streamada.tasks.FFMPEG_SLOT_POLL', 0.01):
+                    waiter.start()
+                    waiter.join(0.2)
+                    self.assertTrue(waiter.is_alive())
+            waiter.join(1)
+            self.assertFalse(waiter.is_alive())
+
+    @override_settings(FFMPEG_THREADS=6)
+    def test_single_pass_outputs_share_the_threads(self):
+        renditions = [('hd480', '480p'), ('hd720', '720p'), ('hd1080', '1080p')]
+        targets = {label: f'/out/{label}.mp4' for _, label in renditions}
+
+        cmd = single_pass_command('/in.mp4', renditions, targets)
+
+        self.assertEqual([cmd[index + 1] for index, arg in enumerate(cmd) if arg == '-threads'], ['2', '2', '2'])
+
+    @mock.patch('django_rq.get_queue')
+    def test_finalize_waits_for_preview(self, mock_get_queue):
+        queue = mock_get_queue.return_value
+        video = Video.objects.create(title="Fan-in", genre="Abstract", video_file="videos/video.mp4")
+        queue.reset_mock()
+
+        enqueue_transcode_jobs(video.id, "/path/to/video.mp4", [('hd480', '480p')], preview_job_id='preview-job')
+
+        preview_call, finalize_call = queue.enqueue.call_args_list[-2:]
+        self.assertEqual(finalize_call.args[0], finalize_video)
+        self.assertEqual(preview_call.args[0], preview_settled)
+        self.assertNotIn('preview-job', finalize_call.kwargs['depends_on'])
+        self.assertIn(queue.enqueue.return_value, finalize_call.kwargs['depends_on'])
+        self.assertEqual(preview_call.kwargs['depends_on'].dependencies, ['preview-job'])
+
+    @mock.patch('django_rq.get_queue')
+    def test_failed_preview_does_not_block_finalize(self, mock_get_queue):
+        queue = mock_get_queue.return_value
+        video = Video.objects.create(title="Fan-in", genre="Abstract", video_file="videos/video.mp4")
+        queue.reset_mock()
+        enqueue_transcode_jobs(video.id, "/path/to/video.mp4", [('hd480', '480p')], preview_job_id='preview-job')
+        dependency = queue.enqueue.call_args_list[-2].kwargs['depends_on']
+
+        # RQ's own check, as the worker runs it when the preview job failed or timed out
+        connection = mock.MagicMock()
+        connection.smembers.return_value = {b'preview-job'}
+        preview_job = mock.Mock(id='preview-job')
+        preview_job.get_status.return_value = JobStatus.FAILED
+        settled = Job.create(preview_settled, args=[video.id], connection=connection, depends_on=dependency)
+        self.assertTrue(settled.dependencies_are_met(parent_job=preview_job))
+
+    @mock.patch('streamada.tasks.run_ffmpeg')
+    @mock.patch('streamada.progress.cache')
+    @mock.patch('streamada.signals.django_rq.get_queue')
+    def test_preview_is_advertised_before_renditions(self, mock_get_queue, mock_cache, mock_run_ffmpeg):
+        video = Video.objects.create(title="Preview", genre="Abstract", video_file="videos/preview.mp4")
+
+        target = encode_preview(video.id, video.video_file.path)
+
+        cmd = mock_run_ffmpeg.call_args.args[0]
+        self.assertEqual(cmd[cmd.index('-preset') + 1], 'ultrafast')
+        self.assertEqual(cmd[-1], target)
+        video.refresh_from_db()
+        data = VideoSerializer(video).data
+        self.assertTrue(data['preview_url'].startswith('/api/media/'))
+        self.assertTrue(data['preview_url'].endswith('/videos/preview_preview.mp4'))
+        self.assertEqual(data['video_480p_url'], '')
+
+    @override_settings(VIDEO_TRANSCODE_MODE='per_rendition')
+    @mock.patch('django_rq.get_queue')
+    def test_renditions_fan_out_and_fan_in(self, mock_get_queue):
+        queue = mock_get_queue.return_value
+        video = Video.objects.create(title="Fan-out", genre="Abstract", video_file="videos/video.mp4")
+        queue.reset_mock()
+        jobs = []
+        queue.enqueue.side_effect = lambda func, *args, **kwargs: jobs.append(mock.MagicMock(name=func.__name__)) or jobs[-1]
+
+        enqueue_transcode_jobs(video.id, "/path/to/video.mp4", [('hd480', '480p'), ('hd720', '720p'), ('hd1080', '1080p')])
+
+        audio_call, *calls = queue.enqueue.call_args_list
+        self.assertEqual(audio_call.args[0], encode_audio)
+        self.assertEqual([call.args[0] for call in calls],
+                         [convert_video, convert_video, convert_video, package_hls, finalize_video])
+        for call in calls[:3]:
+            self.assertIs(call.kwargs['depends_on'], jobs[0])
+            self.assertEqual(call.kwargs['audio'], "/path/to/video_audio.m4a")
+        self.assertEqual(len(calls[3].kwargs['depends_on']), 3)
+        self.assertEqual(len(calls[4].kwargs['depends_on']), 4)
+        self.assertEqual(calls[4].args[1], video.id)
+        renditions = video.renditions.order_by('id')
+        self.assertEqual([rendition.status for rendition in renditions], ['pending'] * 3)
+        self.assertEqual([rendition.job_id for rendition in renditions], [call.kwargs['job_id'] for call in calls[:3]])
+
+
+
+class TranscodeProgressTest(TestCase):
+    @mock.patch('streamada.progress.cache')
+    @mock.patch('subprocess.Popen')
+    def test_run_ffmpeg_stores_progress(self, mock_popen, mock_cache):
+        mock_popen.return_value.stdout = io.StringIO(
+            'frame=250\nfps=50.0\nout_time_us=25000000\nspeed=2.5x\nprogress=continue\n'
+        )
+        mock_popen.return_value.wait.return_value = 0
+        progress = TranscodeProgress(3, ['480p', '720p'], duration_seconds=100)
+
+        run_ffmpeg(['ffmpeg', '-i', 'in.mp4', 'out.mp4'], progress)
+
+        cmd = mock_popen.call_args.args[0]
+        self.assertEqual(cmd[:4], ['ffmpeg', '-nostats', '-progress', 'pipe:1'])
+        stored = mock_cache.set_many.call_args.args[0]
+        self.assertEqual(set(stored), {progress_key(3, '480p'), progress_key(3, '720p')})
+        data = stored[progress_key(3, '480p')]
+        self.assertEqual(data['state'], 'running')
+        self.assertEqual(data['percent'], 25.0)
+        self.assertEqual(data['fps'], 50.0)
+        self.assertEqual(data['speed'], 2.5)
+        self.assertEqual(data['eta_seconds'], 30)
+
+    @mock.patch('subprocess.Popen')
+    def test_run_ffmpeg_raises_on_failure(self, mock_popen):
+        mock_popen.return_value.stdout = io.StringIO('')
+        mock_popen.return_value.wait.return_value = 1
+
+        with self.assertRaises(subprocess.CalledProcessError):
+            run_ffmpeg(['ffmpeg', '-i', 'broken.mp4', 'out.mp4'])
+
+    @mock.patch('streamada.progress.cache')
+    @mock.patch('streamada.signals.django_rq.get_queue')
+    def test_status_endpoint(self, mock_get_queue, mock_cache):
+        user = User.objects.create_user(username='viewer', email='viewer@example.com', password='testpass123')
+        video = Video.objects.create(title="Status", genre="Abstract", video_file="videos/status.mp4", height=720)
+        mock_cache.get_many.return_value = {progress_key(video.id, '480p'): {'state': 'running', 'percent': 40.0}}
+        client = APIClient()
+        client.force_authenticate(user)
+
+        response = client.get(reverse('video-status', kwargs={'id': video.id}))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['renditions'], {
+            '480p': {'state': 'running', 'percent': 40.0},
+            '720p': {'state': 'pending'},
+        })
+
+
+
+class ConvertVideoChunkedTest(TestCase):
+    @override_settings(VIDEO_CHUNK_WORKERS=3)
+    @mock.patch('streamada.tasks.run_ffmpeg')
+    def test_segments_are_encoded_and_concatenated(self, mock_subprocess):
+        frames = {}
+
+        def fake_ffmpeg(cmd, progress=None, part=0):
+            if 'segment' in cmd:
+                chunk_dir = os.path.dirname(cmd[-1])
+                with open(cmd[cmd.index('-segment_list') + 1], 'w') as segment_list:
+                    for index, (start, end) in enumerate([(0, 598), (598, 1203), (1203, 1800)]):
+                        open(os.path.join(chunk_dir, f'chunk_{index:05d}.mkv'), 'w').close()
+                        segment_list.write(f'chunk_{index:05d}.mkv,{start}.000000,{end}.000000\n')
+            elif cmd[-1].endswith('_thumb_%05d.jpg'):
+                chunk = os.path.basename(cmd[2])
+                for index in range(60):
+                    with open(cmd[-1] % (index + 1), 'w') as thumbnail:
+                        thumbnail.write(f'{chunk} {index}')
+            elif '-framerate' in cmd:
+                frame_dir = os.path.dirname(cmd[cmd.index('-i') + 1])
+                for name in os.listdir(frame_dir):
+                    with open(os.path.join(frame_dir, name)) as frame:
+                        frames[name] = frame.read()
+        mock_subprocess.side_effect = fake_ffmpeg
+
+        with tempfile.TemporaryDirectory() as folder:
+            source = os.path.join(folder, 'file.mp4')
+            renditions = [('hd480', '480p'), ('hd720', '720p')]
+
+            targets = convert_video_chunked(source, renditions, 1800)
+
+            self.assertFalse(os.path.exists(os.path.join(folder, 'file_chunks')))
+            self.assertTrue(os.path.isfile(os.path.join(folder, 'file_trickplay', 'thumbnails.vtt')))
+        self.assertEqual(targets, {label: os.path.join(folder, f'file_{label}.mp4') for _, label in renditions})
+
+        commands = [call.args[0] for call in mock_subprocess.call_args_list]
+        split, audio, *encodes = commands[:5]
+        tile = commands[5]
+        concats = commands[6:]
+        self.assertEqual(split[split.index('-segment_time') + 1], '600')
+        # the audio pass never decodes the video, the sprites come from the chunk decodes
+        self.assertIn('-vn', audio)
+        self.assertNotIn('-filter_complex', audio)
+        self.assertEqual(len(encodes), 3)
+        for encode in encodes:
+            self.assertIn('-an', encode)
+            self.assertIn('[thumbnails]', encode)
+        self.assertIn('tile=5x5', tile)
+        self.assertEqual(len(frames), 180)
+        # the second chunk starts at its keyframe at 598s, 600s gets its first thumbnail
+        self.assertEqual(frames['frame_00060.jpg'], 'chunk_00000.mkv 59')
+        self.assertEqual(frames['frame_00061.jpg'], 'chunk_00001.mkv 0')
+        self.assertEqual(frames['frame_00180.jpg'], 'chunk_00002.mkv 59')
+        self.assertEqual(len(concats), 2)
+        for concat, target in zip(concats, targets.values()):
+            self.assertEqual(concat[concat.index('-c') + 1], 'copy')
+            self.assertEqual(concat[-1], target)
+
+    @override_settings(VIDEO_CHUNKED_MIN_DURATION=600)
+    @mock.patch('django_rq.get_queue')
+    def test_only_long_videos_are_chunked(self, mock_get_queue):
+        queue = mock_get_queue.return_value
+        renditions = [('hd480', '480p')]
+        long_video = Video.objects.create(title="Long", genre="Abstract", video_file="videos/long.mp4")
+        short_video = Video.objects.create(title="Short", genre="Abstract", video_file="videos/short.mp4")
+        queue.reset_mock()
+
+        enqueue_transcode_jobs(long_video.id, "/path/to/long.mp4", renditions, duration_seconds=3600)
+        enqueue_transcode_jobs(short_video.id, "/path/to/short.mp4", renditions, duration_seconds=30)
+
+        functions = [call.args[0] for call in queue.enqueue.call_args_list]
+        self.assertEqual(functions[0], convert_video_chunked)
+        self.assertNotIn(convert_video_chunked, functions[1:])
+
+
+
+class ProbeVideoTest(TestCase):
+    ffprobe_output = {
+        'streams': [
+            {'codec_type': 'video', 'codec_name': 'h264', 'width': 854, 'height': 480, 'avg_frame_rate': '30000/1001'},
+            {'codec_type': 'audio', 'codec_name': 'aac'},
+        ],
+        'format': {'duration': '62.500000', 'bit_rate': '1200000'},
+    }
+
+    @mock.patch('subprocess.run')
+    def test_probe_video(self, mock_subprocess):
+        mock_subprocess.return_value.stdout = json.dumps(self.ffprobe_output)
+
+        probe = probe_video("/path/to/video.mp4")
+
+        self.assertEqual(probe['width'], 854)
+        self.assertEqual(probe['height'], 480)
+        self.assertEqual(probe['duration'], timedelta(seconds=62.5))
+        self.assertAlmostEqual(probe['frame_rate'], 29.97, places=2)
+        self.assertEqual(probe['bitrate'], 1200000)
+        self.assertEqual((probe['video_codec'], probe['audio_codec']), ('h264', 'aac'))
+
+    def test_select_renditions_skips_upscaling(self):
+        self.assertEqual(select_renditions(480), [('hd480', '480p')])
+        self.assertEqual(select_renditions(720), [('hd480', '480p'), ('hd720', '720p')])
+        self.assertEqual(len(select_renditions(2160)), 3)
+        self.assertEqual(select_renditions(360), [('hd480', '480p')])
+        self.assertEqual(len(select_renditions(None)), 3)
+
+    @mock.patch('streamada.tasks.enqueue_transcode_jobs')
+    @mock.patch('subprocess.run')
+    @mock.patch('streamada.signals.django_rq.get_queue')
+    def test_analyze_video_stores_probe_and_prunes_ladder(self, mock_get_queue, mock_subprocess, mock_enqueue):
+        mock_subprocess.return_value.stdout = json.dumps(self.ffprobe_output)
+        video = Video.objects.create(title="Probe", genre="Abstract", video_file="videos/probe.mp4")
+
+        analyze_video(video.id, video.video_file.path)
+
+        mock_enqueue.assert_called_once_with(video.id, video.video_file.path, [('hd480', '480p')],
+                                             duration_seconds=62.5, has_audio=True, preview_job_id=None,
+                                             queue_name='transcode', at_front=False)
+        video.refresh_from_db()
+        self.assertEqual(video.height, 480)
+        self.assertEqual(video.duration, timedelta(seconds=62.5))
+
+        VideoRendition.objects.create(video=video, label='480p', status=VideoRendition.DONE,
+                                      path='videos/probe_480p.mp4')
+        video.is_ready = True
+        self.assertEqual(video.video_480p_url, '/media/videos/probe_480p.mp4')
+        self.assertEqual(video.video_720p_url, '')
+        self.assertEqual(video.video_1080p_url, '')
+
+
+class PackageHlsTest(TestCase):
+    def write_variant(self, folder, segments):
+        os.makedirs(folder)
+        lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:6']
+        for index, (duration, size) in enumerate(segments):
+            with open(os.path.join(folder, f'segment_{index:05d}.ts'), 'wb') as segment:
+                segment.write(b'0' * size)
+            lines += [f'#EXTINF:{duration},', f'segment_{index:05d}.ts']
+        lines.append('#EXT-X-ENDLIST')
+        playlist = os.path.join(folder, 'index.m3u8')
+        with open(playlist, 'w') as file:
+            file.write('\n'.join(lines))
+        return playlist
+
+    def test_master_playlist_lists_every_variant(self):
+        with tempfile.TemporaryDirectory() as hls_dir:
+            low = self.write_variant(os.path.join(hls_dir, '480p'), [(6.0, 3000), (2.0, 2000)])
+            high = self.write_variant(os.path.join(hls_dir, '720p'), [(6.0, 9000)])
+
+            master = build_master_playlist([('hd480', '480p', low), ('hd720', '720p', high)])
+
+        self.assertEqual(master.splitlines(), [
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            '#EXT-X-STREAM-INF:BANDWIDTH=8000,AVERAGE-BANDWIDTH=5000,RESOLUTION=852x480',
+            '480p/index.m3u8',
+            '#EXT-X-STREAM-INF:BANDWIDTH=12000,AVERAGE-BANDWIDTH=12000,RESOLUTION=1280x720',
+            '720p/index.m3u8',
+        ])
+
+    @mock.patch('streamada.tasks.build_master_playlist', return_value='#EXTM3U\n')
+    @mock.patch('streamada.tasks.run_ffmpeg')
+    def test_package_hls_remuxes_every_rendition(self, mock_subprocess, mock_master):
+        with tempfile.TemporaryDirectory() as folder:
+            source = os.path.join(folder, 'file.mp4')
+
+            master = package_hls(source, [('hd480', '480p'), ('hd720', '720p')])
+
+            self.assertEqual(master, os.path.join(folder, 'file_hls', 'master.m3u8'))
+            self.assertTrue(os.path.isfile(master))
+        self.assertEqual(mock_subprocess.call_count, 2)
+        for call, label in zip(mock_subprocess.call_args_list, ['480p', '720p']):
+            cmd = call.args[0]
+            self.assertIn(os.path.join(folder, f'file_{label}.mp4'), cmd)
+            self.assertEqual(cmd[cmd.index('-c') + 1], 'copy')
+
+
+
+class FinalizeVideoTest(TestCase):
+    @mock.patch('streamada.tasks.delete_original_file')
+    @mock.patch('streamada.signals.django_rq.get_queue')
+    def test_finalize_marks_video_ready(self, mock_get_queue, mock_delete):
+        video = Video.objects.create(title="Finalize", genre="Abstract", video_file="videos/finalize.mp4")
+        self.assertFalse(video.is_ready)
+
+        finalize_video(video.id, video.video_file.path)
+
+        mock_delete.assert_called_once_with(video.video_file.path)
+        video.refresh_from_db()
+        self.assertTrue(video.is_ready)
+
+
+
+def mp4_boxes(*box_types):
+    """Minimal top level MP4 boxes with a few payload bytes each"""
+    return b''.join(struct.pack('>I4s', 12, box_type) + b'data' for box_type in box_types)
+
+
+
+class ReconcileTranscodesTest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        os.makedirs(os.path.join(self.media_root, 'videos'))
+        self.video = Video.objects.create(title="Crashed", genre="Abstract", video_file="videos/crashed.mp4",
+                                          height=1080, duration=timedelta(seconds=30), audio_codec='aac')
+        self.source = self.video.video_file.path
+        open(self.source, 'w').close()
+        self.queue.reset_mock()
+
+    def write_rendition(self, label, status, content=b'encoded'):
+        with open(self.source.replace('.mp4', f'_{label}.mp4'), 'wb') as file:
+            file.write(content)
+        VideoRendition.objects.create(video=self.video, label=label, status=status, size=len(content),
+                                      path=f'videos/crashed_{label}.mp4')
+
+    @mock.patch('streamada.tasks.output_checksum', return_value='abc')
+    @mock.patch('streamada.tasks.run_ffmpeg', side_effect=subprocess.CalledProcessError(1, 'ffmpeg', stderr='broken'))
+    def test_failed_ffmpeg_marks_rendition_failed(self, mock_run_ffmpeg, mock_checksum):
+        VideoRendition.objects.create(video=self.video, label='720p')
+
+        with mock.patch('streamada.progress.cache'), self.assertRaises(subprocess.CalledProcessError):
+            convert_video(self.source, 'hd720', '720p', video_id=self.video.id)
+
+        rendition = VideoRendition.objects.get(video=self.video, label='720p')
+        self.assertEqual(rendition.status, VideoRendition.FAILED)
+        self.assertIn('broken', rendition.error)
+
+    @mock.patch('streamada.tasks.run_ffmpeg')
+    def test_finished_rendition_records_size_and_checksum(self, mock_run_ffmpeg):
+        target = self.source.replace('.mp4', '_480p.mp4')
+        content = mp4_boxes(b'ftyp', b'moov', b'mdat')
+        mock_run_ffmpeg.side_effect = lambda cmd, progress=None: open(target, 'wb').write(content)
+
+        with mock.patch('streamada.progress.cache'):
+            convert_video(self.source, 'hd480', '480p', video_id=self.video.id)
+
+        rendition = VideoRendition.objects.get(video=self.video, label='480p')
+        checksum = hashlib.sha256(content).hexdigest()
+        self.assertEqual(rendition.status, VideoRendition.DONE)
+        self.assertEqual(rendition.size, len(content))
+        self.assertEqual(rendition.checksum, checksum)
+        self.assertEqual(rendition.path, f'videos/crashed_480p.{checksum[:16]}.mp4')
+        self.assertFalse(os.path.exists(target))
+        self.assertTrue(rendition_intact(rendition))
+        self.assertEqual((rendition.codec, rendition.width, rendition.height), ('h264', 852, 480))
+        self.assertEqual(rendition.bitrate, len(content) * 8 // 30)
+
+        Video.objects.filter(pk=self.video.pk).update(is_ready=True)
+        self.assertEqual(Video.objects.get(pk=self.video.pk).video_480p_url, f'/media/{rendition.path}')
+
+    @mock.patch('streamada.tasks.run_ffmpeg')
+    def test_rendition_without_fast_start_fails(self, mock_run_ffmpeg):
+        target = self.source.replace('.mp4', '_480p.mp4')
+        mock_run_ffmpeg.side_effect = lambda cmd, progress=None: open(target, 'wb').write(mp4_boxes(b'ftyp', b'mdat', b'moov'))
+        VideoRendition.objects.create(video=self.video, label='480p')
+
+        with mock.patch('streamada.progress.cache'), self.assertRaises(ValueError):
+            convert_video(self.source, 'hd480', '480p', video_id=self.video.id)
+
+        rendition = VideoRendition.objects.get(video=self.video, label='480p')
+        self.assertEqual(rendition.status, VideoRendition.FAILED)
+        self.assertIn('not fast start', rendition.error)
+
+    def test_verify_faststart_reads_large_boxes(self):
+        large_mdat = struct.pack('>I4sQ', 1, b'mdat', 16 + 4) + b'data'
+        with tempfile.NamedTemporaryFile() as file:
+            file.write(mp4_boxes(b'ftyp', b'free') + large_mdat + mp4_boxes(b'moov'))
+            file.flush()
+
+            with self.assertRaises(ValueError):
+                verify_faststart(file.name)
+
+    @mock.patch('streamada.tasks.job_alive', return_value=False)
+    def test_only_missing_and_failed_renditions_are_enqueued(self, mock_job_alive):
+        self.write_rendition('480p', VideoRendition.DONE)
+        self.write_rendition('720p', VideoRendition.FAILED)
+        VideoRendition.objects.create(video=self.video, label='1080p', status=VideoRendition.RUNNING, job_id='dead')
+
+        out = io.StringIO()
+        call_command('reconcile_transcodes', stdout=out)
+
+        self.assertIn(f'Video {self.video.id}: enqueued 720p, 1080p', out.getvalue())
+        calls = self.queue.enqueue.call_args_list
+        self.assertEqual([call.args[0] for call in calls], [convert_video_single_pass, package_hls, finalize_video])
+        self.assertEqual(calls[0].args[2], [('hd720', '720p'), ('hd1080', '1080p')])
+        self.assertEqual(len(calls[1].args[2]), 3)
+        mock_job_alive.assert_called_once_with('dead')
+
+    @mock.patch('streamada.tasks.job_alive', return_value=True)
+    def test_running_jobs_are_left_alone(self, mock_job_alive):
+        self.write_rendition('480p', VideoRendition.DONE)
+        VideoRendition.objects.create(video=self.video, label='720p', status=VideoRendition.RUNNING, job_id='alive')
+
+        self.assertEqual(reconcile_video(self.video), [])
+        self.queue.enqueue.assert_not_called()
+
+    def test_lost_rendition_file_is_encoded_again(self):
+        for label in ['480p', '720p', '1080p']:
+            self.write_rendition(label, VideoRendition.DONE)
+        os.remove(self.source.replace('.mp4', '_720p.mp4'))
+
+        self.assertEqual(reconcile_video(self.video), ['720p'])
+
+    def test_finished_renditions_are_packaged_after_a_crash(self):
+        for label in ['480p', '720p', '1080p']:
+            self.write_rendition(label, VideoRendition.DONE)
+
+        self.assertEqual(reconcile_video(self.video), [])
+        self.assertEqual(reconcile_video(self.video, stale_after=timedelta(0)), ['package'])
+        functions = [call.args[0] for call in self.queue.enqueue.call_args_list]
+        self.assertEqual(functions, [package_hls, finalize_video])
+
+    def test_unanalyzed_video_is_analyzed_again(self):
+        self.assertEqual(reconcile_video(self.video), [])
+
+        self.assertEqual(reconcile_video(self.video, stale_after=timedelta(0)), ['analyze'])
+        functions = [call.args[0] for call in self.queue.enqueue.call_args_list]
+        self.assertEqual(functions, [encode_preview, analyze_video])
+
+    @override_settings(TRANSCODE_MAX_ATTEMPTS=2)
+    @mock.patch('streamada.tasks.job_alive', return_value=False)
+    def test_failing_video_is_reported_after_the_last_attempt(self, mock_job_alive):
+        self.write_rendition('480p', VideoRendition.FAILED)
+
+        for _ in range(3):
+            out, err = io.StringIO(), io.StringIO()
+            call_command('reconcile_transcodes', stdout=out, stderr=err)
+
+        self.assertEqual(Video.objects.get(pk=self.video.pk).reconcile_attempts, 2)
+        self.assertEqual(out.getvalue(), '')
+        self.assertIn(f'Video {self.video.id} was re-enqueued 2 times', err.getvalue())
+        self.assertEqual([call.args[0] for call in self.queue.enqueue.call_args_list].count(finalize_video), 2)
+
+    @override_settings(TRANSCODE_MAX_ATTEMPTS=1)
+    def test_unanalyzed_video_is_not_analyzed_forever(self):
+        reconcile_video(self.video, stale_after=timedelta(0))
+
+        with self.assertRaises(ReconcileAttemptsExhausted):
+            reconcile_video(Video.objects.get(pk=self.video.pk), stale_after=timedelta(0))
+
+
+
+class BenchmarkTranscodeTest(TestCase):
+    def test_measure_reports_rendition_bytes(self):
+        def fake_mode(source, renditions, duration_seconds):
+            targets = {label: source.replace('.mp4', f'_{label}.mp4') for _, label in renditions}
+            for target in targets.values():
+                with open(target, 'wb') as file:
+                    file.write(b'x' * 100)
+            return targets
+
+        with tempfile.TemporaryDirectory() as folder, \
+                mock.patch.dict(benchmark_transcode.BENCHMARK_MODES, {'fake': fake_mode}):
+            source = os.path.join(folder, 'source.mp4')
+            open(source, 'w').close()
+
+            result = benchmark_transcode.measure('fake', source, [('hd480', '480p')], 10)
+
+            self.assertEqual(os.listdir(folder), ['source.mp4'])
+        self.assertEqual(result['renditions'], {'480p': 100})
+        self.assertGreater(result['fps'], 0)
+
+    @mock.patch('streamada.management.commands.benchmark_transcode.ffmpeg_version', return_value='ffmpeg version 7.0')
+    @mock.patch('streamada.management.commands.benchmark_transcode.ProcessPoolExecutor',
+                lambda *args, **kwargs: ThreadPoolExecutor(1))
+    @mock.patch('streamada.management.commands.benchmark_transcode.measure')
+    @mock.patch('streamada.management.commands.benchmark_transcode.generate_source', return_value='/tmp/source.mp4')
+    def test_command_writes_table_and_json(self, mock_generate, mock_measure, mock_version):
+        mock_measure.return_value = {'wall_seconds': 2.0, 'cpu_seconds': 7.5, 'peak_rss_mb': 210.0, 'fps': 150.0,
+                                     'renditions': {'480p': 1000, '720p': 2000}}
+        out = io.StringIO()
+
+        with tempfile.TemporaryDirectory() as folder:
+            output = os.path.join(folder, 'results.json')
+            call_command('benchmark_transcode', sizes='1280x720', durations='10', modes='single_pass,chunked',
+                         output=output, stdout=out, stderr=io.StringIO())
+            with open(output) as file:
+                report = json.load(file)
+
+        self.assertEqual(mock_measure.call_args.args, ('chunked', '/tmp/source.mp4', [('hd480', '480p'), ('hd720', '720p')], 10))
+        self.assertEqual([result['mode'] for result in report['results']], ['single_pass', 'chunked'])
+        self.assertEqual(report['ffmpeg'], 'ffmpeg version 7.0')
+        table = out.getvalue().splitlines()
+        self.assertTrue(table[0].startswith('source'))
+        self.assertEqual(len(table), 1 + 4 + 1)
+
+
+
+class DeduplicationTest(TemporaryMediaMixin, TestCase):
+    def test_upload_handler_hashes_while_streaming(self):
+        handler = HashingTemporaryFileUploadHandler()
+        handler.new_file('video_file', 'clip.mp4', 'video/mp4', 6)
+        handler.receive_data_chunk(b'abc', 0)
+        handler.receive_data_chunk(b'def', 3)
+
+        upload = handler.file_complete(6)
+
+        self.assertEqual(upload.content_hash, hashlib.sha256(b'abcdef').hexdigest())
+
+    def test_identical_upload_reuses_renditions(self):
+        content = b'same bytes'
+        original = Video.objects.create(title="Original", genre="Abstract", video_file="videos/original.mp4",
+                                        is_ready=True, height=720)
+        Video.objects.filter(pk=original.pk).update(content_hash=hashlib.sha256(content).hexdigest())
+        VideoRendition.objects.create(video=original, label='720p', status=VideoRendition.DONE,
+                                      path='videos/original_720p.0123456789abcdef.mp4', size=4096, codec='h264',
+                                      width=1280, height=720, bitrate=2500000)
+        self.mock_get_queue.reset_mock()
+
+        duplicate = Video.objects.create(title="Duplicate", genre="Abstract",
+                                         video_file=SimpleUploadedFile("duplicate.mp4", content))
+
+        self.mock_get_queue.assert_not_called()
+        self.assertFalse(os.listdir(os.path.join(settings.MEDIA_ROOT, 'videos')))
+        duplicate.refresh_from_db()
+        self.assertEqual(duplicate.video_file.name, "videos/original.mp4")
+        self.assertTrue(duplicate.is_ready)
+        self.assertEqual(duplicate.video_720p_url, original.video_720p_url)
+        self.assertEqual(duplicate.video_720p_url, '/media/videos/original_720p.0123456789abcdef.mp4')
+        self.assertEqual(duplicate.rendition_sources, original.rendition_sources)
+        self.assertEqual(duplicate.rendition_sources[0]['codec'], 'h264')
+        self.assertEqual(duplicate.rendition_sources[0]['bitrate'], 2500000)
+
+    def test_shared_renditions_are_kept_until_last_reference(self):
+        first = Video.objects.create(title="First", genre="Abstract", video_file="videos/shared.mp4")
+        second = Video.objects.create(title="Second", genre="Abstract", video_file="videos/second.mp4")
+        # what reuse_existing_renditions leaves behind
+        Video.objects.filter(pk=second.pk).update(video_file="videos/shared.mp4")
+        second.refresh_from_db()
+
+        with mock.patch('streamada.storage.cache'), mock.patch('os.path.isfile', return_value=True), \
+                mock.patch('os.remove') as mock_remove:
+            first.delete()
+            purge_media_tombstones()
+            mock_remove.assert_not_called()
+
+            second.delete()
+            purge_media_tombstones()
+            mock_remove.assert_any_call(os.path.join(settings.MEDIA_ROOT, 'videos', 'shared_480p.mp4'))
+
+
+
+class StreamVideoTest(TemporaryMediaMixin, TestCase):
+    def media_settings(self):
+        return {'MEDIA_STREAM_MODE': 'sendfile'}
+
+    def setUp(self):
+        super().setUp()
+        self.video = Video.objects.create(title="Stream", genre="Abstract", video_file="videos/clip.mp4",
+                                          is_ready=True, height=720)
+        VideoRendition.objects.create(video=self.video, label='720p', status=VideoRendition.DONE,
+                                      path='videos/clip_720p.mp4')
+        self.content = bytes(range(256)) * 4
+        self.path = os.path.join(settings.MEDIA_ROOT, 'videos', 'clip_720p.mp4')
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'wb') as file:
+            file.write(self.content)
+
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='viewer', password='testpass123'))
+        self.url = reverse('video-stream', kwargs={'id': self.video.id, 'label': '720p'})
+
+    def get(self, **headers):
+        response = self.client.get(self.url, headers=headers)
+        self.addCleanup(response.close)
+        return response
+
+    def test_whole_file_without_range(self):
+        response = self.get()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Type'], 'video/mp4')
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+    def test_range_request_only_sends_the_range(self):
+        response = self.get(Range='bytes=100-199')
+
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response['Content-Range'], 'bytes 100-199/1024')
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:200])
+
+        self.assertEqual(b''.join(self.get(Range='bytes=-24').streaming_content), self.content[-24:])
+        self.assertEqual(self.get(Range='bytes=2000-').status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+    def test_range_file_keeps_the_descriptor_at_the_range(self):
+        range_file = RangeFile(self.path, 1000, 20)
+        self.addCleanup(range_file.close)
+
+        self.assertEqual(os.lseek(range_file.fileno(), 0, os.SEEK_CUR), 1000)
+        self.assertEqual(range_file.read(4096), self.content[1000:1020])
+        self.assertEqual(range_file.read(4096), b'')
+        self.assertEqual(range_file.seek(0, os.SEEK_END), 20)
+
+    def test_only_versioned_media_is_immutable(self):
+        self.assertNotIn('Cache-Control', self.get())
+
+        versioned_name = 'videos/clip_720p.0123456789abcdef.mp4'
+        os.rename(self.path, os.path.join(settings.MEDIA_ROOT, versioned_name))
+        VideoRendition.objects.filter(video=self.video, label='720p').update(path=versioned_name)
+
+        response = self.get(Range='bytes=0-9')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        with override_settings(MEDIA_STREAM_MODE='x-accel-redirect'):
+            self.assertEqual(self.get()['Cache-Control'], 'public, max-age=31536000, immutable')
+
+    def test_thumbnails_get_a_versioned_name(self):
+        first, second = thumbnail_upload_to(self.video, 'poster.jpg'), thumbnail_upload_to(self.video, 'poster.jpg')
+
+        self.assertRegex(first, r'^thumbnails/poster\.[0-9a-f]{16}\.jpg$')
+        self.assertNotEqual(first, second)
+
+    def test_offload_to_the_web_server(self):
+        with override_settings(MEDIA_STREAM_MODE='x-accel-redirect'):
+            response = self.get(Range='bytes=0-1')
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/videos/clip_720p.mp4')
+        self.assertEqual(response.content, b'')
+
+        with override_settings(MEDIA_STREAM_MODE='x-sendfile'):
+            self.assertEqual(self.get()['X-Sendfile'], self.path)
+
+    def test_missing_rendition_and_anonymous_user(self):
+        url = reverse('video-stream', kwargs={'id': self.video.id, 'label': '1080p'})
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+
+class SignedMediaTest(TemporaryMediaMixin, TestCase):
+    def media_settings(self):
+        return {'MEDIA_STREAM_MODE': 'sendfile'}
+
+    def setUp(self):
+        super().setUp()
+        self.video = Video.objects.create(title="Signed", genre="Abstract", video_file="videos/clip.mp4",
+                                          is_ready=True, height=720)
+        VideoRendition.objects.create(video=self.video, label='720p', status=VideoRendition.DONE,
+                                      path='videos/clip_720p.mp4')
+
+        for name in ['videos/clip_720p.mp4', 'videos/clip_hls/master.m3u8', 'videos/clip_hls/720p/index.m3u8']:
+            path = os.path.join(settings.MEDIA_ROOT, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as file:
+                file.write(name)
+
+    def test_serializer_signs_media_urls_without_database_access(self):
+        data = VideoSerializer(self.video).data
+
+        with self.assertNumQueries(0):
+            response = self.client.get(data['video_720p_url'])
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(b''.join(response.streaming_content), b'videos/clip_720p.mp4')
+            response.close()
+
+    def test_playlist_signature_covers_relative_references(self):
+        manifest_url = VideoSerializer(self.video).data['manifest_url']
+        variant_url = manifest_url.replace('master.m3u8', '720p/index.m3u8')
+
+        response = self.client.get(variant_url)
+        self.addCleanup(response.close)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        rendition_url = VideoSerializer(self.video).data['video_720p_url']
+        self.assertEqual(self.client.get(rendition_url.replace('clip_720p', 'clip_1080p')).status_code,
+                         status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.get(manifest_url.replace('clip_hls/master.m3u8', 'clip_720p.mp4')).status_code,
+                         status.HTTP_403_FORBIDDEN)
+
+    def test_directories_are_not_served(self):
+        manifest_url = VideoSerializer(self.video).data['manifest_url']
+
+        self.assertEqual(self.client.get(manifest_url.replace('master.m3u8', '720p')).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+    def test_expired_and_tampered_urls_are_rejected(self):
+        url = sign_media_url('/media/videos/clip_720p.mp4')
+        token = url.split('/')[3]
+
+        self.assertTrue(verify_media_token(token, 'videos/clip_720p.mp4'))
+        self.assertFalse(verify_media_token(token[:-1] + ('A' if token[-1] != 'A' else 'B'), 'videos/clip_720p.mp4'))
+        self.assertFalse(verify_media_token(token, 'videos/../videos/clip_720p.mp4'))
+        with mock.patch('streamada.signed_media.time.time', return_value=time.time() + settings.MEDIA_URL_TTL * 2):
+            self.assertFalse(verify_media_token(token, 'videos/clip_720p.mp4'))
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_urls_are_stable_within_a_bucket(self):
+        self.assertEqual(sign_media_url('/media/videos/clip_720p.mp4'), sign_media_url('/media/videos/clip_720p.mp4'))
 
 
-class AutoDeleteFileOnDeleteTest(TestCase):
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ResumableUploadTest(TemporaryMediaMixin, TestCase):
+    def media_settings(self):
+        return {'UPLOAD_CHUNK_DIR': os.path.join(self.media_root, 'uploads')}
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='editor', email='editor@example.com', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_upload(self, length):
+        metadata = ','.join(f'{key} {base64.b64encode(value.encode()).decode()}' for key, value in
+                            {'filename': 'clip.mp4', 'title': 'Clip', 'genre': 'Sport'}.items())
+        return self.client.post(reverse('video-upload-create'), HTTP_UPLOAD_LENGTH=str(length),
+                                HTTP_UPLOAD_METADATA=metadata)
+
+    def send_chunk(self, location, offset, data):
+        return self.client.patch(location, data=data, content_type='application/offset+octet-stream',
+                                 HTTP_UPLOAD_OFFSET=str(offset))
+
+    def test_out_of_order_chunks_create_the_video(self):
+        content = b'0123456789abcdef'
+        response = self.create_upload(len(content))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        location = response['Location']
+
+        self.assertEqual(self.send_chunk(location, 8, content[8:]).status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.head(location)['Upload-Offset'], '0')
+        self.assertEqual(Video.objects.count(), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.send_chunk(location, 0, content[:8])
+
+        self.assertEqual(response['Upload-Offset'], str(len(content)))
+        video = Video.objects.get()
+        self.assertEqual((video.title, video.genre), ('Clip', 'Sport'))
+        with open(video.video_file.path, 'rb') as file:
+            self.assertEqual(file.read(), content)
+        self.assertEqual(VideoUpload.objects.get().video, video)
+
+        # the request does not read the assembled file again, a worker hashes it
+        self.assertEqual(video.content_hash, '')
+        self.mock_get_queue.return_value.enqueue.assert_called_once_with(hash_upload, video.id, video.video_file.path,
+                                                                         at_front=False)
+        self.mock_get_queue.reset_mock()
+        hash_upload(video.id, video.video_file.path)
+        self.assertEqual(Video.objects.get().content_hash, hashlib.sha256(content).hexdigest())
+        self.assertEqual(self.mock_get_queue.return_value.enqueue.call_args_list[0].args[0], encode_preview)
+
+    def test_upload_named_like_an_existing_video_gets_its_own_name(self):
+        # finalize_video deleted the earlier upload, only its row and renditions are left
+        existing = Video.objects.create(title='Earlier', genre='Sport', video_file='videos/clip.MOV',
+                                        content_hash='0' * 64)
+        content = b'0123456789abcdef'
+        location = self.create_upload(len(content))['Location']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.send_chunk(location, 0, content)
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        video = Video.objects.exclude(pk=existing.pk).get()
+        self.assertRegex(video.video_file.name, r'^videos/clip_[0-9a-f]{8}\.mp4$')
+        with open(video.video_file.path, 'rb') as file:
+            self.assertEqual(file.read(), content)
+
+    def test_failed_save_leaves_the_upload_in_place(self):
+        content = b'0123456789abcdef'
+        location = self.create_upload(len(content))['Location']
+        upload = VideoUpload.objects.get()
+
+        with mock.patch('streamada.views.Video.save', side_effect=ValueError('clash')):
+            with self.assertRaises(ValueError):
+                self.send_chunk(location, 0, content)
+
+        self.assertTrue(os.path.exists(upload.path))
+        self.assertEqual(Video.objects.count(), 0)
+        self.assertFalse(os.path.exists(os.path.join(settings.MEDIA_ROOT, 'videos', 'clip.mp4')))
+
+    def test_chunk_outside_of_upload_is_rejected(self):
+        location = self.create_upload(4)['Location']
+
+        response = self.send_chunk(location, 2, b'abcd')
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_uploads_of_other_users_are_hidden(self):
+        location = self.create_upload(4)['Location']
+        other = User.objects.create_user(username='other', email='other@example.com', password='testpass123')
+        self.client.force_authenticate(other)
+
+        self.assertEqual(self.client.head(location).status_code, status.HTTP_404_NOT_FOUND)
+
+
+
+class AutoDeleteFileOnDeleteTest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache_patch = mock.patch('streamada.storage.cache')
+        self.mock_cache = cache_patch.start()
+        self.addCleanup(cache_patch.stop)
+        for module in ['streamada.feed', 'streamada.cache']:
+            module_cache_patch = mock.patch(f'{module}.cache')
+            module_cache_patch.start()
+            self.addCleanup(module_cache_patch.stop)
+
+    def write_media(self):
+        for folder in ['videos', 'videos/video_hls', 'thumbnails']:
+            os.makedirs(os.path.join(settings.MEDIA_ROOT, folder))
+        for name in ['videos/video_480p.mp4', 'videos/video_720p.mp4', 'videos/video_1080p.mp4',
+                     'videos/video_hls/master.m3u8', 'thumbnails/thumbnail.jpg']:
+            open(os.path.join(settings.MEDIA_ROOT, name), 'w').close()
+
     @mock.patch('os.remove')
-    @mock.patch('os.path.isfile')
-    def test_auto_delete_file_on_delete(self, mock_isfile, mock_remove):
-        video = Video(video_file=mock.MagicMock(path="/path/to/video.mp4"), thumbnail=mock.MagicMock(path="/path/to/thumbnail.jpg"))
-
-        mock_isfile.side_effect = lambda path: path in [
-            "/path/to/video_480p.mp4",
-            "/path/to/video_720p.mp4",
-            "/path/to/video_1080p.mp4",
-            "/path/to/thumbnail.jpg"
-        ]
-        auto_delete_file_on_delete(Video, video)
-        mock_remove.assert_any_call("/path/to/video_480p.mp4")
-        mock_remove.assert_any_call("/path/to/video_720p.mp4")
-        mock_remove.assert_any_call("/path/to/video_1080p.mp4")
-        mock_remove.assert_any_call("/path/to/thumbnail.jpg")
-
-        self.assertEqual(mock_remove.call_count, 6)
+    def test_auto_delete_file_on_delete(self, mock_remove):
+        video = Video.objects.create(title="Delete", genre="Abstract", video_file="videos/video.mp4",
+                                     thumbnail="thumbnails/thumbnail.jpg")
+        self.write_media()
+        self.mock_get_queue.reset_mock()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            video.delete()
+
+        mock_remove.assert_not_called()
+        tombstone = MediaTombstone.objects.get()
+        self.assertEqual((tombstone.video_file, tombstone.thumbnail), ("videos/video.mp4", "thumbnails/thumbnail.jpg"))
+        self.mock_get_queue.assert_called_with('backfill')
+        self.queue.enqueue.assert_called_once_with(purge_media_tombstones)
+
+    def test_purge_removes_files_in_batches(self):
+        self.write_media()
+        MediaTombstone.objects.create(video_file="videos/video.mp4", thumbnail="thumbnails/thumbnail.jpg")
+        MediaTombstone.objects.create(video_file="videos/other.mp4")
+
+        with mock.patch('streamada.storage.schedule_media_purge') as mock_schedule:
+            self.assertEqual(purge_media_tombstones(batch_size=1), 1)
+            mock_schedule.assert_called_once()
+
+        self.assertFalse(os.listdir(os.path.join(settings.MEDIA_ROOT, 'videos')))
+        self.assertFalse(os.listdir(os.path.join(settings.MEDIA_ROOT, 'thumbnails')))
+        self.assertEqual(purge_media_tombstones(batch_size=10), 1)
+        self.assertFalse(MediaTombstone.objects.exists())
+
+    def test_purge_removes_versioned_renditions(self):
+        self.write_media()
+        for name in ['videos/video_720p.0123456789abcdef.mp4', 'videos/video_720p_1080p.0123456789abcdef.mp4']:
+            open(os.path.join(settings.MEDIA_ROOT, name), 'w').close()
+        MediaTombstone.objects.create(video_file="videos/video.mp4")
+
+        purge_media_tombstones()
+
+        self.assertEqual(os.listdir(os.path.join(settings.MEDIA_ROOT, 'videos')),
+                         ['video_720p_1080p.0123456789abcdef.mp4'])
+        self.assertFalse(MediaTombstone.objects.exists())
+
+    def test_sweep_reports_orphaned_files(self):
+        Video.objects.create(title="Live", genre="Abstract", video_file="videos/video.mp4")
+        self.write_media()
+        with open(os.path.join(settings.MEDIA_ROOT, 'videos', 'gone_720p.mp4'), 'wb') as file:
+            file.write(b'x' * 2048)
+
+        out = io.StringIO()
+        call_command('sweep_media', min_age=0, stdout=out)
+
+        output = out.getvalue()
+        self.assertIn(os.path.join('videos', 'gone_720p.mp4'), output)
+        self.assertIn(os.path.join('thumbnails', 'thumbnail.jpg'), output)
+        self.assertNotIn('video_480p.mp4', output)
+        self.assertIn('Reclaimable: 2048 bytes', output)
+
+        call_command('sweep_media', min_age=0, delete=True, stdout=io.StringIO())
+        self.assertEqual(find_orphaned_media(), [])
+        self.assertTrue(os.path.isfile(os.path.join(settings.MEDIA_ROOT, 'videos', 'video_480p.mp4')))
 
 
 
@@ -0,0 +1,49 @@
+import hashlib
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+
+
+def file_sha256(file):
+    """
+    Hashes a file chunk by chunk, used for files that did not come through the hashing upload handlers.
+    """
+    sha256 = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks():
+        sha256.update(chunk)
+    file.seek(0)
+    return sha256.hexdigest()
+
+
+
+class HashingUploadMixin:
+    """
+    Hashes the upload while Django streams it to memory or disk and puts the hex digest on the uploaded file
+    as content_hash, so the file does not have to be read a second time.
+    """
+
+    def new_file(self, *args, **kwargs):
+        self.sha256 = hashlib.sha256()
+        return super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        # the memory handler passes large files on to the next handler, which hashes them instead
+        if getattr(self, 'activated', True):
+            self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.content_hash = self.sha256.hexdigest()
+        return file
+
+
+
+class HashingMemoryFileUploadHandler(HashingUploadMixin, MemoryFileUploadHandler):
+    pass
+
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadMixin, TemporaryFileUploadHandler):
+    pass
@@ -8,8 +8,7 @@ from django.utils.http import urlsafe_base64_decode
 from django.utils.encoding import force_str
 from django.contrib.auth.models import User
 from rest_framework.permissions import AllowAny
-from app_settings.settings import CACHE_TTL
-from streamada.models import Video
+from streamada.models import Video, sibling_name
 from streamada.serializers import UserSerializer, LoginSerializer
 from django.shortcuts import redirect
 from rest_framework.authtoken.models import Token
@@ -19,8 +18,27 @@ from django.views.decorators.csrf import csrf_exempt
 from .serializers import PasswordResetConfirmSerializer, PasswordResetSerializer, VideoSerializer
 from rest_framework.views import APIView
 from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
 from rest_framework import generics
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from streamada.progress import get_progress
+import base64
+import binascii
+import os
+import uuid
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from streamada.models import VideoUpload, GENRE_CHOICES
+from streamada.streaming import media_response
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from django.views.decorators.http import require_safe
+from streamada.signed_media import verify_media_token
+from streamada.pagination import VideoCursorPagination
+from streamada.feed import get_feed, NEW_VIDEO_FEED
+from streamada.fragments import FRAGMENT_COLUMNS, dumps, fragment_rows, render_video, render_videos
+from streamada.cache import cached_api_data
+from streamada.search import search_terms, search_videos
 
 
 
@@ -58,7 +76,6 @@ def activate_user(request, uidb64, token):
 @csrf_exempt
 @api_view(['POST'])
 @permission_classes([AllowAny])
-@cache_page(CACHE_TTL) 
 def login_user(request):
     serializer = LoginSerializer(data=request.data)
     if serializer.is_valid():
@@ -101,19 +118,84 @@ class PasswordResetConfirmView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
 
+BOOLEAN_QUERY_VALUES = {'true': True, '1': True, 'false': False, '0': False}
+
+
+
+def video_list_filters(query_params):
+    """Queryset filters of ?genre= and ?add_to_new_video_feed=, raises ValueError for invalid values"""
+    filters = {}
+    genre = query_params.get('genre')
+    if genre is not None:
+        if genre not in dict(GENRE_CHOICES):
+            raise ValueError('Invalid genre')
+        filters['genre'] = genre
+    new_video_feed = query_params.get('add_to_new_video_feed')
+    if new_video_feed is not None:
+        if new_video_feed.lower() not in BOOLEAN_QUERY_VALUES:
+            raise ValueError('add_to_new_video_feed must be true or false')
+        filters['add_to_new_video_feed'] = BOOLEAN_QUERY_VALUES[new_video_feed.lower()]
+    return filters
+
+
+
+def build_video_list(request):
+    """Cached data of a video list page, built again by refresh_api_cache from the URL alone"""
+    queryset = Video.objects.filter(**video_list_filters(request.query_params)).values(*FRAGMENT_COLUMNS)
+    paginator = VideoCursorPagination()
+    page = paginator.paginate_queryset(queryset, request)
+    return {'next': paginator.get_next_link(), 'previous': paginator.get_previous_link(),
+            'results': fragment_rows(page)}
+
+
+
+def build_video_detail(request, id):
+    rows = fragment_rows(Video.objects.filter(id=id).values(*FRAGMENT_COLUMNS))
+    if not rows:
+        raise Http404('No Video matches the given query.')
+    return rows[0]
+
+
+
+def build_video_feed(request):
+    return get_feed()
+
+
+
 @permission_classes([IsAuthenticated])
 class VideoListAPIView(generics.ListAPIView):
-    queryset = Video.objects.all()
+    """
+    Cursor paginated list of the videos, newest first.
+    ?genre=Sport and ?add_to_new_video_feed=true filter it.
+    """
+    queryset = Video.objects.prefetch_related('renditions')
     serializer_class = VideoSerializer
+    pagination_class = VideoCursorPagination
+
+    def list(self, request, *args, **kwargs):
+        try:
+            video_list_filters(request.query_params)
+        except ValueError as error:
+            return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        data = cached_api_data(request, build_video_list)
+        # the page is spliced together from the stored fragments, DRF's serializer and renderer do not run
+        content = (f'{{"next":{dumps(data["next"])},"previous":{dumps(data["previous"])},'
+                   f'"results":{render_videos(data["results"], request)}}}')
+        return HttpResponse(content, content_type='application/json')
 
 
 
 @permission_classes([IsAuthenticated])
 class VideoDetailAPIView(generics.RetrieveUpdateAPIView):
-    queryset = Video.objects.all()
+    queryset = Video.objects.prefetch_related('renditions')
     serializer_class = VideoSerializer
     lookup_field = 'id'
 
+    def retrieve(self, request, *args, **kwargs):
+        _, fragment, media = cached_api_data(request, build_video_detail, id=kwargs['id'])
+        return HttpResponse(render_video(fragment, media, request), content_type='application/json')
+
     def update(self, request, *args, **kwargs):
         partial = kwargs.pop('partial', False)
         instance = self.get_object()
@@ -121,4 +203,238 @@ class VideoDetailAPIView(generics.RetrieveUpdateAPIView):
         serializer.is_valid(raise_exception=True)
         self.perform_update(serializer)
 
-        return Response(serializer.data)
\ No newline at end of file
+        return Response(serializer.data)
+
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def video_status(request, id):
+    video = get_object_or_404(Video, id=id)
+    labels = [label for _, label in video.rendition_ladder]
+    return Response({
+        'id': video.id,
+        'is_ready': video.is_ready,
+        'renditions': get_progress(video.id, labels),
+    })
+
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def video_feed(request):
+    """
+    The home screen in one response => the new video feed and the newest videos of every genre.
+    The rows come from the cache, only their media URLs are signed per request.
+    """
+    feed = cached_api_data(request, build_video_feed)
+    genres = ','.join(
+        f'{{"genre":{dumps(genre)},"name":{dumps(name)},"videos":{render_videos(feed[genre], request)}}}'
+        for genre, name in GENRE_CHOICES
+    )
+    content = f'{{"new_video_feed":{render_videos(feed[NEW_VIDEO_FEED], request)},"genres":[{genres}]}}'
+    return HttpResponse(content, content_type='application/json')
+
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def video_search(request):
+    """
+    Full-text search over the titles and descriptions => ?q=crime sto&genre=Crime&limit=10
+    Best matches first, every word matches as a prefix, so it can be called while the user types.
+    """
+    query = request.query_params.get('q', '')
+    genre = request.query_params.get('genre')
+    if not search_terms(query):
+        return Response({'error': 'q needs at least one word'}, status=status.HTTP_400_BAD_REQUEST)
+    if genre is not None and genre not in dict(GENRE_CHOICES):
+        return Response({'error': 'Invalid genre'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        limit = int(request.query_params.get('limit', settings.VIDEO_PAGE_SIZE))
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        return Response({'error': 'limit must be a positive number'}, status=status.HTTP_400_BAD_REQUEST)
+
+    ids = search_videos(query, genre, min(limit, settings.VIDEO_MAX_PAGE_SIZE))
+    rows = {row[0]: row for row in fragment_rows(Video.objects.filter(id__in=ids).values(*FRAGMENT_COLUMNS))}
+    results = render_videos([rows[video_id] for video_id in ids if video_id in rows], request)
+    return HttpResponse(f'{{"results":{results}}}', content_type='application/json')
+
+
+
+@api_view(['GET', 'HEAD'])
+@permission_classes([IsAuthenticated])
+def stream_video(request, id, label):
+    """
+    Streams a rendition (480p, 720p, 1080p) or the preview with HTTP Range support,
+    so seeking only transfers the requested bytes
+    """
+    video = get_object_or_404(Video, id=id)
+    name = video.rendition_name(label)
+    if not name or not os.path.isfile(default_storage.path(name)):
+        raise Http404('Rendition not available')
+    return media_response(request, default_storage.path(name), name)
+
+
+
+@require_safe
+def serve_signed_media(request, token, name):
+    """
+    Serves media behind a URL from sign_media_url. A plain Django view without DRF authentication,
+    the HMAC check needs no database query, so every Range request of a player stays cheap.
+    """
+    if not verify_media_token(token, name):
+        return HttpResponseForbidden('Invalid or expired media URL')
+    # exists() is also true for a directory like videos/, only files are served
+    if not os.path.isfile(default_storage.path(name)):
+        raise Http404('Media not found')
+    return media_response(request, default_storage.path(name), name)
+
+
+
+UPLOAD_READ_SIZE = 1024 * 1024
+TUS_HEADERS = {'Tus-Resumable': '1.0.0'}
+
+
+def parse_upload_metadata(header):
+    """Parses the tus Upload-Metadata header => 'key base64value,key base64value'"""
+    metadata = {}
+    for pair in filter(None, (item.strip() for item in header.split(','))):
+        key, _, value = pair.partition(' ')
+        metadata[key] = base64.b64decode(value).decode() if value else ''
+    return metadata
+
+
+def available_video_name(filename):
+    """
+    videos/<filename>, with a random suffix when another video already has the base name => the renditions of
+    videos/clip.mp4 are never shared with an earlier clip.MOV, the video_post_save check would reject the save
+    """
+    base, extension = os.path.splitext(os.path.basename(filename))
+    name = os.path.join('videos', base + extension)
+    base_name = sibling_name(name, '')
+    others = Video.objects.filter(video_file__startswith=f'{base_name}.').values_list('video_file', flat=True)
+    if default_storage.exists(name) or any(sibling_name(other, '') == base_name for other in others):
+        name = os.path.join('videos', f'{base}_{uuid.uuid4().hex[:8]}{extension}')
+    return name
+
+
+def assemble_upload(upload):
+    """
+    Creates the Video of a complete upload and moves the file to videos/. The row is saved first, the file is only
+    moved when the save went through, a failed save leaves the upload in place for the next PATCH.
+    The file is hashed by the hash_upload job after the commit, the request does not read gigabytes while it
+    holds the row lock.
+    """
+    name = available_video_name(upload.filename)
+    metadata = upload.metadata
+    video = Video(
+        title=metadata['title'],
+        description=metadata.get('description', ''),
+        genre=metadata['genre'],
+        add_to_new_video_feed=metadata.get('add_to_new_video_feed', '').lower() in ('1', 'true', 'yes'),
+        video_file=name,
+    )
+    with transaction.atomic():
+        video.save()
+        os.makedirs(os.path.dirname(default_storage.path(name)), exist_ok=True)
+        os.replace(upload.path, default_storage.path(name))
+    return video
+
+
+@permission_classes([IsAuthenticated])
+class VideoUploadCreateView(APIView):
+    """Creates a resumable upload, the chunks are sent with PATCH to the returned Location"""
+
+    def post(self, request, *args, **kwargs):
+        try:
+            length = int(request.headers.get('Upload-Length', ''))
+            metadata = parse_upload_metadata(request.headers.get('Upload-Metadata', ''))
+        except (ValueError, binascii.Error, UnicodeDecodeError):
+            return Response({'error': 'Invalid Upload-Length or Upload-Metadata'}, status=status.HTTP_400_BAD_REQUEST)
+
+        missing = [key for key in ('filename', 'title', 'genre') if not metadata.get(key)]
+        if length <= 0 or missing:
+            return Response({'error': f'Upload-Length must be positive, missing metadata: {missing}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if metadata['genre'] not in dict(GENRE_CHOICES):
+            return Response({'error': 'Invalid genre'}, status=status.HTTP_400_BAD_REQUEST)
+
+        upload = VideoUpload.objects.create(user=request.user, filename=metadata['filename'],
+                                            length=length, metadata=metadata)
+        # preallocate the file, so chunks can be written at their offset in any order
+        os.makedirs(settings.UPLOAD_CHUNK_DIR, exist_ok=True)
+        with open(upload.path, 'wb') as file:
+            file.truncate(length)
+
+        response = Response({'id': str(upload.id)}, status=status.HTTP_201_CREATED, headers=TUS_HEADERS)
+        response['Location'] = reverse('video-upload', kwargs={'upload_id': upload.id})
+        return response
+
+
+@permission_classes([IsAuthenticated])
+class VideoUploadView(APIView):
+    """
+    HEAD/GET report the received bytes, PATCH writes one chunk at its Upload-Offset.
+    Chunks may arrive out of order and in parallel, the video is created after the last missing byte arrived.
+    """
+
+    def get_upload(self, request, upload_id):
+        return get_object_or_404(VideoUpload, id=upload_id, user=request.user)
+
+    def upload_headers(self, upload):
+        return {**TUS_HEADERS, 'Upload-Offset': str(upload.offset), 'Upload-Length': str(upload.length),
+                'Cache-Control': 'no-store'}
+
+    def head(self, request, upload_id):
+        upload = self.get_upload(request, upload_id)
+        return Response(status=status.HTTP_200_OK, headers=self.upload_headers(upload))
+
+    def get(self, request, upload_id):
+        upload = self.get_upload(request, upload_id)
+        return Response({
+            'id': str(upload.id),
+            'length': upload.length,
+            'received_ranges': upload.received_ranges,
+            'video': upload.video_id,
+        }, headers=self.upload_headers(upload))
+
+    def patch(self, request, upload_id):
+        upload = self.get_upload(request, upload_id)
+        if request.content_type != 'application/offset+octet-stream':
+            return Response({'error': 'Content-Type must be application/offset+octet-stream'},
+                            status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+            chunk_length = int(request.headers.get('Content-Length', ''))
+        except ValueError:
+            return Response({'error': 'Invalid Upload-Offset'}, status=status.HTTP_400_BAD_REQUEST)
+        if offset < 0 or offset + chunk_length > upload.length:
+            return Response({'error': 'Chunk is outside of the upload'}, status=status.HTTP_409_CONFLICT)
+        if upload.video_id:
+            return Response(status=status.HTTP_204_NO_CONTENT, headers=self.upload_headers(upload))
+
+        # stream the body to its position in the file, without keeping the chunk in memory
+        written = 0
+        with open(upload.path, 'r+b') as file:
+            file.seek(offset)
+            while written < chunk_length:
+                data = request.stream.read(min(UPLOAD_READ_SIZE, chunk_length - written))
+                if not data:
+                    break
+                file.write(data)
+                written += len(data)
+
+        with transaction.atomic():
+            upload = VideoUpload.objects.select_for_update().get(pk=upload.pk)
+            if written:
+                upload.add_range(offset, offset + written)
+                upload.save(update_fields=['received_ranges'])
+            if upload.is_complete and not upload.video_id:
+                upload.video = assemble_upload(upload)
+                upload.save(update_fields=['video'])
+
+        return Response(status=status.HTTP_204_NO_CONTENT, headers=self.upload_headers(upload))
+